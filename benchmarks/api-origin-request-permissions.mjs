@@ -0,0 +1,110 @@
+
+// Local harness comparing the per request permission filtering with the compiled permission index
+//
+// Requires the function dependencies: npm install --prefix tlaloc_cdn_builder/functions/api-origin-request
+// Usage: node benchmarks/api-origin-request-permissions.mjs [requests] [ruleCounts]
+
+import { compilePermissions, conditionMatches, matchPermissions } from '../tlaloc_cdn_builder/functions/api-origin-request/permissions.mjs';
+import { createRequire } from 'module';
+
+const { minimatch } = createRequire(new URL('../tlaloc_cdn_builder/functions/api-origin-request/package.json', import.meta.url))('minimatch');
+
+const requests = Number(process.argv[2] || 2000);
+const ruleCounts = (process.argv[3] || '10,100,1000,5000').split(',').map(Number);
+const methods = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE'];
+const apis = ['admin', 'profile', 'service', 'user'];
+
+function pick(values, seed) {
+    return values[seed % values.length];
+}
+
+// Synthetic permissions mixing literal, single segment and recursive resources as found in the permissions table
+function syntheticPermissions(count) {
+    return Array.from({ length: count }, (_, iter) => {
+        const resource = [
+            `/api/${pick(apis, iter)}/resource${iter % 97}`,
+            `/api/${pick(apis, iter)}/resource${iter % 89}/*`,
+            `/api/${pick(apis, iter)}/resource${iter % 83}/**`,
+            `/api/${pick(apis, iter)}/*/items${iter % 7}`,
+        ][iter % 4];
+        return {
+            authorized_exception: iter % 11 === 0,
+            condition: iter % 13 === 0 ? 'return parameters.request.method !== "DELETE";' : undefined,
+            effect: iter % 17 === 0 ? 'deny' : 'allow',
+            methods: new Set(iter % 5 === 0 ? ['*', `!${pick(methods, iter)}`] : [pick(methods, iter), pick(methods, iter + 1)]),
+            resource,
+        };
+    });
+}
+
+// Some requests use doubled slashes and dot segments, which minimatch resolves before matching
+function syntheticRequest(iter) {
+    const separator = ['/', '/', '/', '/', '//', '/./'][iter % 6];
+    return {
+        method: pick(methods, iter),
+        uri: `/api/${pick(apis, iter * 7)}${separator}resource${iter % 97}/${iter % 3 ? 'items3' : 'detail'}`,
+    };
+}
+
+// Previous behaviour, every rule is filtered with a freshly compiled glob and the result scanned per effect
+function evaluateLinear(permissions, request, weelockAuthentication) {
+    const matching = permissions.filter((permission) => (permission.methods.has('*') || permission.methods.has(request.method))
+        && minimatch(request.uri, permission.resource)
+        && !permission.methods.has(`!${request.method}`)
+        && (weelockAuthentication.authorized || permission.authorized_exception));
+    const deny = matching.filter((permission) => permission.effect === 'deny');
+    const allow = matching.filter((permission) => permission.effect === 'allow');
+    const parameters = { request, weelockAuthentication };
+    // eslint-disable-next-line no-new-func
+    const denied = deny.some((permission) => !permission.condition || new Function('parameters', permission.condition)(parameters));
+    // eslint-disable-next-line no-new-func
+    return !denied && allow.some((permission) => !permission.condition || new Function('parameters', permission.condition)(parameters));
+}
+
+function evaluateIndexed(index, request, weelockAuthentication) {
+    const { allow, deny } = matchPermissions(index, request, weelockAuthentication);
+    const parameters = { request, weelockAuthentication };
+    const denied = deny.some((permission) => !permission.condition || conditionMatches(permission, parameters));
+    return !denied && allow.some((permission) => !permission.condition || conditionMatches(permission, parameters));
+}
+
+function timed(callback) {
+    const start = process.hrtime.bigint();
+    const result = callback();
+    return [result, Number(process.hrtime.bigint() - start) / 1e6];
+}
+
+const weelockAuthentication = { authorized: true };
+
+// A deny rule must apply whatever the spelling of the path
+const bypassPermissions = [
+    { effect: 'allow', methods: new Set(['*']), resource: '/api/**' },
+    { effect: 'deny', methods: new Set(['DELETE']), resource: '/api/admin/users/*' },
+];
+const bypassIndex = compilePermissions(bypassPermissions);
+['/api/admin/users/1', '/api/admin//users/1', '//api/admin/users/1', '/api/admin/./users/1'].forEach((uri) => {
+    const request = { method: 'DELETE', uri };
+    const linear = evaluateLinear(bypassPermissions, request, weelockAuthentication);
+    const indexed = evaluateIndexed(bypassIndex, request, weelockAuthentication);
+    console.log(`DELETE ${uri}: linear ${linear ? 'allow' : 'deny'}, indexed ${indexed ? 'allow' : 'deny'}${linear === indexed ? '' : ' MISMATCH'}`);
+    if (linear !== indexed) {
+        process.exitCode = 1;
+    }
+});
+
+console.log(`\n${requests} requests per permission set\n`);
+ruleCounts.forEach((count) => {
+    const permissions = syntheticPermissions(count);
+    const [index, compileMs] = timed(() => compilePermissions(permissions));
+    const [linear, linearMs] = timed(() => Array.from({ length: requests }, (_, iter) => evaluateLinear(permissions, syntheticRequest(iter), weelockAuthentication)));
+    const [indexed, indexedMs] = timed(() => Array.from({ length: requests }, (_, iter) => evaluateIndexed(index, syntheticRequest(iter), weelockAuthentication)));
+    const mismatches = linear.filter((decision, iter) => decision !== indexed[iter]).length;
+    console.log(`${count} rules`);
+    console.log(`    index build   ${compileMs.toFixed(2)} ms`);
+    console.log(`    linear        ${((1000 * linearMs) / requests).toFixed(1)} us/request`);
+    console.log(`    indexed       ${((1000 * indexedMs) / requests).toFixed(1)} us/request`);
+    console.log(`    mismatches    ${mismatches}`);
+    if (mismatches > 0) {
+        process.exitCode = 1;
+    }
+});
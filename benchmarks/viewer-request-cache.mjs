@@ -0,0 +1,88 @@
+
+// Local harness comparing the viewer-request lookups with and without the warm container cache
+//
+// Usage: node benchmarks/viewer-request-cache.mjs [requests] [users] [latencyMs] [concurrency]
+
+import { TtlCache, digest } from '../tlaloc_cdn_builder/functions/viewer-request/cache.mjs';
+
+const requests = Number(process.argv[2] || 2000);
+const users = Number(process.argv[3] || 50);
+const latency = Number(process.argv[4] || 80);
+const concurrency = Number(process.argv[5] || 20);
+
+function sleep(milliseconds) {
+    return new Promise((resolve) => {
+        setTimeout(resolve, milliseconds);
+    });
+}
+
+// Stubbed client answering after a fixed latency and counting the calls it receives
+function stubClient(response) {
+    const client = {
+        calls: 0,
+        async send() {
+            client.calls += 1;
+            await sleep(latency);
+            return response;
+        },
+    };
+    return client;
+}
+
+function accessToken(user) {
+    const encode = (value) => Buffer.from(JSON.stringify(value)).toString('base64url');
+    const payload = { exp: Math.floor(Date.now() / 1000) + 3600, sub: `user-${user}` };
+    return `${encode({ alg: 'none' })}.${encode(payload)}.signature`;
+}
+
+// Skewed user selection, a few users produce most of the traffic as in real sessions
+function pickUser() {
+    return Math.floor(users * (Math.random() ** 3));
+}
+
+function percentile(sorted, point) {
+    return sorted[Math.min(sorted.length - 1, Math.floor((point / 100) * sorted.length))];
+}
+
+async function run(name, capacity, ttl) {
+    const cognitoClient = stubClient({ UserAttributes: [{ Name: 'sub', Value: 'user' }] });
+    const dynamodbClient = stubClient({ Item: { valid: true } });
+    const userAttributesCache = new TtlCache(capacity, ttl);
+    const userConfigCache = new TtlCache(capacity, ttl);
+    const tokens = Array.from({ length: users }, (_, user) => accessToken(user));
+    const latencies = [];
+
+    async function lookup() {
+        const user = pickUser();
+        const start = process.hrtime.bigint();
+        if (capacity > 0) {
+            await Promise.all([
+                userAttributesCache.fetch(digest(tokens[user]), () => cognitoClient.send()),
+                userConfigCache.fetch(`user-${user}`, () => dynamodbClient.send()),
+            ]);
+        } else {
+            await Promise.all([cognitoClient.send(), dynamodbClient.send()]);
+        }
+        latencies.push(Number(process.hrtime.bigint() - start) / 1e6);
+    }
+
+    const start = Date.now();
+    for (let done = 0; done < requests; done += concurrency) {
+        const batch = Math.min(concurrency, requests - done);
+        await Promise.all(Array.from({ length: batch }, lookup));
+    }
+    const elapsed = Date.now() - start;
+
+    latencies.sort((left, right) => left - right);
+    const stats = userAttributesCache.stats;
+    const lookups = Math.max(1, stats.hits + stats.misses + stats.coalesced);
+    console.log(`${name}`);
+    console.log(`    hit rate      ${((100 * stats.hits) / lookups).toFixed(1)}% (${stats.coalesced} coalesced)`);
+    console.log(`    backend calls cognito ${cognitoClient.calls}, dynamodb ${dynamodbClient.calls}`);
+    console.log(`    latency ms    p50 ${percentile(latencies, 50).toFixed(1)}, p90 ${percentile(latencies, 90).toFixed(1)}, p99 ${percentile(latencies, 99).toFixed(1)}`);
+    console.log(`    elapsed ms    ${elapsed}`);
+}
+
+console.log(`${requests} requests, ${users} users, ${latency} ms backend latency, ${concurrency} concurrent\n`);
+await run('Without cache', 0, 0);
+await run('With cache', 1000, 60000);
@@ -0,0 +1,37 @@
+# tests/conftest.py
+
+import copy
+import pytest
+
+builder_config_defaults = {
+    "deployer": "test",
+    "type": "per",
+    "provider": "aws",
+    "aws_profile": "test",
+    "aws_stack": "test",
+    "aws_stack_hash": "test",
+    "aws_region": "us-east-1",
+    "aws_bucket": "test",
+    "aws_domain": "test.example.com",
+    "aws_hosted_zone_id": "test",
+    "aws_origins": [{"type": "s3", "name": "test", "default": True}],
+    "aws_user_pool_client_id": "test",
+    "aws_user_pool_id": "test",
+    "aws_account_id": "test",
+}
+
+
+@pytest.fixture(scope="class")
+def builder_config(request):
+    """
+    This fixture returns a factory of builder configs with the given parameters overriding the defaults,
+    the unittest classes using it get the factory as their builder_config attribute
+    """
+
+    def builder_config(**parameters):
+        return copy.deepcopy({**builder_config_defaults, **parameters})
+
+    if request.cls is not None:
+        request.cls.builder_config = staticmethod(builder_config)
+
+    return builder_config
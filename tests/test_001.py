@@ -0,0 +1,56 @@
+# tests/test_001.py
+
+import pytest
+import unittest
+from unittest import mock
+from tlaloc_cdn_builder import builder
+from tlaloc_cdn_builder.harness import recommend_memory, synthetic_corpus
+from tlaloc_cdn_builder.stats import percentiles
+
+
+@pytest.mark.usefixtures("builder_config")
+class TestHarness(unittest.TestCase):
+
+    def test_percentiles(self):
+        values = list(range(1, 101))
+        self.assertEqual(
+            percentiles(values), {"p50": 50, "p90": 90, "p99": 99}
+        )
+        self.assertEqual(percentiles([], points=(50,)), {"p50": None})
+
+    def test_recommend_memory(self):
+        self.assertEqual(recommend_memory(40, "origin-request"), 128)
+        self.assertEqual(recommend_memory(100, "origin-request"), 192)
+        self.assertEqual(recommend_memory(100, "viewer-request"), 128)
+
+    def test_build_recommendations(self):
+        cdn = builder(self.builder_config(aws_functions_memory={"api-origin-request": 256}))
+        with mock.patch.object(builder, "_aws_build"), mock.patch.object(builder, "_write_manifest"):
+            cdn.build(memory_recommended={"api-origin-request": 256, "viewer-request": 1024})
+            with self.assertRaises(ValueError):
+                cdn.build(memory_recommended={"unknown": 128})
+
+        # Only the functions configured below the recommendation are reported
+        self.assertEqual(list(cdn.manifest["memory_below_recommended"]), ["viewer-request"])
+        self.assertEqual(cdn.manifest["memory_below_recommended"]["viewer-request"]["memory_recommended"], 1024)
+
+    def test_synthetic_corpus(self):
+        corpus = synthetic_corpus()
+        for event_type in ["viewer-request", "origin-request", "origin-response"]:
+            self.assertTrue(corpus[event_type])
+            for event in corpus[event_type]:
+                record = event["Records"][0]["cf"]
+                self.assertEqual(record["config"]["eventType"], event_type)
+                self.assertEqual(event_type == "origin-response", "response" in record)
+
+        # Authenticated requests are spread over the principals
+        corpus = synthetic_corpus(principals=3)
+        headers = {
+            event["Records"][0]["cf"]["request"]["headers"]["weelock-authentication"][0]["value"]
+            for event in corpus["origin-request"]
+        }
+        self.assertEqual(len(headers), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+# tests/test_002.py
+
+import os
+import gzip
+import json
+import pytest
+import tempfile
+import unittest
+from tlaloc_cdn_builder import builder
+from tlaloc_cdn_builder.metrics import aggregate
+
+
+def emf_line(function, timings):
+    payload = {
+        "_aws": {
+            "CloudWatchMetrics": [
+                {
+                    "Dimensions": [["Function"]],
+                    "Metrics": [
+                        {"Name": step, "Unit": "Milliseconds"} for step in timings
+                    ],
+                    "Namespace": "TlalocCdn",
+                }
+            ],
+            "Timestamp": 0,
+        },
+        "Function": function,
+        **timings,
+    }
+    return f"2024-01-01T00:00:00.000Z {json.dumps(payload)}\n"
+
+
+@pytest.mark.usefixtures("builder_config")
+class TestInstrumentation(unittest.TestCase):
+
+    def test_aggregate(self):
+        with tempfile.TemporaryDirectory() as path:
+            with open(os.path.join(path, "plain.log"), "w") as f:
+                f.write("START RequestId: 1\n")
+                for value in range(1, 11):
+                    f.write(emf_line("viewer-request", {"handler": [value]}))
+            with gzip.open(os.path.join(path, "compressed.log.gz"), "wt") as f:
+                f.write(emf_line("viewer-request", {"GetUserCommand": [5, 7]}))
+            result = aggregate(
+                [
+                    os.path.join(path, "plain.log"),
+                    os.path.join(path, "compressed.log.gz"),
+                ]
+            )
+        self.assertEqual(
+            result["viewer-request"]["handler"],
+            {"count": 10, "p50": 5, "p90": 9, "p99": 10},
+        )
+        self.assertEqual(result["viewer-request"]["GetUserCommand"]["count"], 2)
+
+    def test_instrument_mjs(self):
+        cdn = builder(self.builder_config())
+        with tempfile.TemporaryDirectory() as path:
+            file_path = os.path.join(path, "index.mjs")
+            with open(file_path, "w") as f:
+                f.write(
+                    "export async function handler(event) {\n"
+                    "    return sqsClient.send(new SendMessageCommand({}));\n"
+                    "}\n"
+                )
+            cdn._instrument_mjs(file_path, "test")
+            file_content = open(file_path).read()
+        self.assertTrue(file_content.startswith("import { probe } from './probe.mjs';"))
+        self.assertIn("probe.send(sqsClient, new SendMessageCommand({}))", file_content)
+        self.assertIn("async function handlerUninstrumented(event)", file_content)
+        self.assertIn(
+            "export const handler = probe.handler('test', handlerUninstrumented);",
+            file_content,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+# tests/test_003.py
+
+import os
+import json
+import pytest
+import tempfile
+import unittest
+from unittest import mock
+from tlaloc_cdn_builder import builder
+from tlaloc_cdn_builder.providers import local_provider
+
+
+def template(versions):
+    resources = {
+        "Function": {
+            "Type": "AWS::Lambda::Function",
+            "Properties": {
+                "FunctionName": "test-function",
+                "Code": {"S3Bucket": "bucket", "S3Key": "CDN/function.zip"},
+            },
+        }
+    }
+    for version in versions:
+        resources[f"FunctionVersion{version}"] = {
+            "Type": "AWS::Lambda::Version",
+            "DeletionPolicy": "Retain",
+            "Properties": {"FunctionName": {"Ref": "Function"}},
+        }
+    return {"Resources": resources}
+
+
+@pytest.mark.usefixtures("builder_config")
+class TestLocalProvider(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+        self.config = {
+            "local_path": os.path.join(self.path, "local"),
+            "aws_stack": "test",
+            "aws_bucket": "bucket",
+            "aws_folder": "CDN",
+            "aws_region": "us-east-1",
+            "aws_account_id": "123456789012",
+        }
+        self.provider = local_provider(self.config)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def upload(self, key, content):
+        path = os.path.join(self.path, "upload")
+        with open(path, "w") as f:
+            f.write(content)
+        self.provider.upload_file(path, "bucket", key, metadata={"sha256": "test"})
+
+    def deploy(self, name, content):
+        self.config["aws_template_file"] = name
+        self.upload(f"CDN/{name}", json.dumps(content))
+        return self.provider.deploy(None)
+
+    def test_objects(self):
+        self.upload("CDN/function.zip", "zip")
+        self.upload("other/file.txt", "text")
+        objects = self.provider.list_objects("bucket", "CDN/")
+        self.assertEqual([item["key"] for item in objects], ["CDN/function.zip"])
+        self.assertEqual(objects[0]["size"], 3)
+        self.assertEqual(self.provider.get_object("bucket", "CDN/function.zip"), b"zip")
+        with self.assertRaises(ValueError):
+            self.provider.get_object("bucket", "CDN/missing.zip")
+
+    def test_deploy(self):
+        self.upload("CDN/function.zip", "zip")
+        self.assertIsNone(self.provider.stack_status())
+        self.assertEqual(self.deploy("1.json", template([1])), "CREATE_COMPLETE")
+        self.assertEqual(self.deploy("2.json", template([2])), "UPDATE_COMPLETE")
+        stack = json.load(open(os.path.join(self.path, "local", "stacks", "test.json")))
+        self.assertTrue(stack["resources"]["FunctionVersion1"]["retained"])
+        self.assertFalse(stack["resources"]["FunctionVersion2"]["retained"])
+        self.assertEqual(
+            stack["resources"]["FunctionVersion2"]["physical_id"],
+            "arn:aws:lambda:us-east-1:123456789012:function:test-function:2",
+        )
+
+    def test_deploy_rollback(self):
+        with self.assertRaises(ValueError):
+            self.deploy("1.json", template([1]))
+        self.assertEqual(self.provider.stack_status(), "ROLLBACK_COMPLETE")
+
+        # The stack must be deleted before deploying again, even once the artifact exists
+        self.upload("CDN/function.zip", "zip")
+        with self.assertRaisesRegex(ValueError, "ROLLBACK_COMPLETE state and can not be updated"):
+            self.deploy("2.json", template([2]))
+        os.remove(os.path.join(self.path, "local", "stacks", "test.json"))
+        self.assertEqual(self.deploy("2.json", template([2])), "CREATE_COMPLETE")
+
+    def test_builder_config(self):
+        cdn = builder(self.builder_config(provider="local"))
+        self.assertEqual(cdn.config["local_path"], ".CDN-local")
+        with self.assertRaises(ValueError):
+            builder({**cdn.config, "provider": "gcp"})
+
+    def test_build_offline(self):
+        # npm fails as it would without network, the local provider must not need it
+        path_bin = os.path.join(self.path, "bin")
+        os.makedirs(path_bin)
+        with open(os.path.join(path_bin, "npm"), "w") as f:
+            f.write("#!/bin/sh\nexit 1\n")
+        os.chmod(os.path.join(path_bin, "npm"), 0o755)
+        directory = os.getcwd()
+        os.chdir(self.path)
+        try:
+            with mock.patch.dict(os.environ, {"PATH": f"{path_bin}:{os.environ["PATH"]}"}):
+                cdn = builder(
+                    self.builder_config(
+                        provider="local",
+                        local_path=os.path.join(self.path, "local"),
+                        aws_bucket="bucket",
+                        aws_origins=[
+                            {"type": "s3", "name": "test", "default": True},
+                            {"type": "apigateway", "domain_name": "api.example.com", "mask": "/api/*"},
+                        ],
+                        aws_account_id="123456789012",
+                    )
+                )
+                cdn.build()
+                cdn.deploy()
+        finally:
+            os.chdir(directory)
+        self.assertEqual(cdn.manifest["stack_status"], "CREATE_COMPLETE")
+        self.assertEqual(len([name for name in cdn.manifest["artifacts"] if name.endswith(".zip")]), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+# tests/test_004.py
+
+import os
+import json
+import pytest
+import tempfile
+import unittest
+from unittest import mock
+from botocore.exceptions import ClientError
+from tlaloc_commons import commons  # type: ignore
+from tlaloc_cdn_builder import builder
+from tlaloc_cdn_builder.providers import aws_provider, local_provider
+
+
+def client_error(code, message):
+    return ClientError({"Error": {"Code": code, "Message": message}}, "ListStackResources")
+
+
+@pytest.mark.usefixtures("builder_config")
+class TestCollectGarbage(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+        self.cdn = builder(
+            self.builder_config(
+                provider="local",
+                local_path=os.path.join(self.path, "local"),
+                aws_stack_hash="stack",
+                aws_bucket="bucket",
+            )
+        )
+        self.provider = local_provider(self.cdn.config)
+        self.function_hash = commons.get_hash("test-viewer-request")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def upload(self, key, content):
+        path = os.path.join(self.path, "upload")
+        with open(path, "w") as f:
+            f.write(content)
+        self.provider.upload_file(path, "bucket", key)
+
+    def deploy(self, timestamp):
+        package = f"CDN/{timestamp}-{self.function_hash}-us-east-1.zip"
+        self.upload(package, f"package {timestamp}")
+        template = {
+            "Resources": {
+                "Function": {
+                    "Type": "AWS::Lambda::Function",
+                    "Properties": {
+                        "FunctionName": "test-viewer-request",
+                        "Code": {"S3Bucket": "bucket", "S3Key": package},
+                    },
+                },
+                f"FunctionVersion{timestamp}": {
+                    "Type": "AWS::Lambda::Version",
+                    "DeletionPolicy": "Retain",
+                    "Properties": {"FunctionName": {"Ref": "Function"}},
+                },
+            }
+        }
+        self.cdn.config["aws_template_file"] = f"{timestamp}-stack-us-east-1.json"
+        self.upload(f"CDN/{timestamp}-stack-us-east-1.json", json.dumps(template))
+        self.provider.deploy(self.cdn)
+
+    def test_collect_garbage(self):
+        for timestamp in [1, 2, 3]:
+            self.deploy(timestamp)
+        orphan = f"CDN/4-{self.function_hash}-0123456789ab-us-east-1.zip"
+        self.upload(orphan, "orphan")
+        self.upload("CDN/5-ffffffff-us-east-1.zip", "other stack")
+        self.upload("CDN/1-other-us-east-1.json", "{}")
+
+        # The dry run only reports
+        report = self.cdn.collect_garbage(templates=2)
+        self.assertEqual(report["deleted"], ["CDN/1-stack-us-east-1.json", orphan])
+        self.assertIn(f"CDN/1-{self.function_hash}-us-east-1.zip", report["kept"])
+        self.assertEqual(len(self.provider.list_objects("bucket", "CDN/")), 9)
+
+        # The packages of retained versions survive their templates
+        report = self.cdn.collect_garbage(templates=1, dry_run=False, workers=2)
+        self.assertEqual(
+            report["deleted"],
+            [
+                "CDN/1-stack-us-east-1.json",
+                "CDN/2-stack-us-east-1.json",
+                orphan,
+            ],
+        )
+        self.assertEqual(report["errors"], [])
+        self.assertEqual(
+            [item["key"] for item in self.provider.list_objects("bucket", "CDN/")],
+            sorted(
+                [
+                    "CDN/1-other-us-east-1.json",
+                    f"CDN/1-{self.function_hash}-us-east-1.zip",
+                    f"CDN/2-{self.function_hash}-us-east-1.zip",
+                    f"CDN/3-{self.function_hash}-us-east-1.zip",
+                    "CDN/3-stack-us-east-1.json",
+                    "CDN/5-ffffffff-us-east-1.zip",
+                ]
+            ),
+        )
+
+    def test_collect_garbage_listing_failure(self):
+        for timestamp in [1, 2, 3]:
+            self.deploy(timestamp)
+        keys = self.provider.list_objects("bucket", "CDN/")
+
+        # Without the versions in use no package can be told garbage
+        with mock.patch.object(
+            local_provider, "list_function_versions", side_effect=client_error("AccessDenied", "Denied")
+        ):
+            with self.assertRaises(ClientError):
+                self.cdn.collect_garbage(templates=1, dry_run=False)
+        self.assertEqual(self.provider.list_objects("bucket", "CDN/"), keys)
+
+    def test_list_function_versions(self):
+        with mock.patch("tlaloc_cdn_builder.providers.boto3.Session") as session:
+            paginate = session.return_value.client.return_value.get_paginator.return_value.paginate
+            provider = aws_provider({**self.cdn.config, "aws_profile": "test"})
+
+            # A stack not created yet has no versions
+            paginate.side_effect = client_error("ValidationError", "Stack with id test does not exist")
+            self.assertEqual(provider.list_function_versions(), [])
+
+            # Any other error is raised
+            paginate.side_effect = client_error("AccessDenied", "Denied")
+            with self.assertRaises(ClientError):
+                provider.list_function_versions()
+
+    def test_collect_garbage_parameters(self):
+        with self.assertRaises(ValueError):
+            self.cdn.collect_garbage(templates=0)
+        with self.assertRaises(ValueError):
+            self.cdn.collect_garbage(workers=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+# tests/test_005.py
+
+import pytest
+import unittest
+from tlaloc_cdn_builder import builder
+
+
+@pytest.mark.usefixtures("builder_config")
+class TestResponseHeaders(unittest.TestCase):
+
+    def config(self, origin, **parameters):
+        return self.builder_config(
+            aws_origins=[
+                {"type": "s3", "name": "test", "default": True},
+                {"type": "apigateway", "domain_name": "api.example.com", "mask": "/api/*", **origin},
+            ],
+            **parameters,
+        )
+
+    def test_defaults(self):
+        cdn = builder(self.config({}))
+        origin = cdn.config["aws_origins"][1]
+        self.assertFalse(origin["origin_response"])
+        policy = cdn._aws_response_headers_policy(origin, 1)
+        policy_config = policy["Properties"]["ResponseHeadersPolicyConfig"]
+        self.assertEqual(policy_config["Name"], "test-origin001-headers")
+        self.assertEqual(
+            policy_config["CorsConfig"],
+            {
+                "AccessControlAllowCredentials": False,
+                "AccessControlAllowHeaders": {"Items": ["*"]},
+                "AccessControlAllowMethods": {"Items": ["ALL"]},
+                "AccessControlAllowOrigins": {"Items": ["*"]},
+                "OriginOverride": False,
+            },
+        )
+        self.assertNotIn("SecurityHeadersConfig", policy_config)
+
+    def test_security(self):
+        cdn = builder(
+            self.config(
+                {
+                    "response_headers": {
+                        "cors": False,
+                        "security": {
+                            "frame_options": "DENY",
+                            "strict_transport_security": 31536000,
+                            "include_subdomains": True,
+                        },
+                    }
+                }
+            )
+        )
+        policy = cdn._aws_response_headers_policy(cdn.config["aws_origins"][1], 1)
+        policy_config = policy["Properties"]["ResponseHeadersPolicyConfig"]
+        self.assertNotIn("CorsConfig", policy_config)
+        self.assertEqual(
+            policy_config["SecurityHeadersConfig"]["FrameOptions"],
+            {"FrameOption": "DENY", "Override": True},
+        )
+        self.assertTrue(
+            policy_config["SecurityHeadersConfig"]["StrictTransportSecurity"]["IncludeSubdomains"]
+        )
+
+    def test_no_headers(self):
+        cdn = builder(self.config({"response_headers": {"cors": False}}))
+        self.assertIsNone(cdn._aws_response_headers_policy(cdn.config["aws_origins"][1], 1))
+
+    def test_not_per(self):
+        cdn = builder(self.config({"response_headers": {"security": {"content_type_options": True}}}, type="pro"))
+        policy = cdn._aws_response_headers_policy(cdn.config["aws_origins"][1], 1)
+        self.assertNotIn("CorsConfig", policy["Properties"]["ResponseHeadersPolicyConfig"])
+        self.assertIsNone(cdn._aws_response_headers_policy(builder(self.config({}, type="pro")).config["aws_origins"][1], 1))
+
+        # Explicit settings still send the CORS headers
+        cdn = builder(self.config({"response_headers": {"cors": {"allow_origins": ["https://example.com"]}}}, type="pro"))
+        policy = cdn._aws_response_headers_policy(cdn.config["aws_origins"][1], 1)
+        self.assertEqual(
+            policy["Properties"]["ResponseHeadersPolicyConfig"]["CorsConfig"]["AccessControlAllowOrigins"],
+            {"Items": ["https://example.com"]},
+        )
+
+    def test_invalid(self):
+        for origin in [
+            {"origin_response": "yes"},
+            {"response_headers": {"unknown": {}}},
+            {"response_headers": {"cors": {"allow_methods": ["GET", "ALL"]}}},
+            {"response_headers": {"cors": {"allow_credentials": True}}},
+            {"response_headers": {"security": {"frame_options": "ALLOW"}}},
+        ]:
+            with self.assertRaises(ValueError):
+                builder(self.config(origin))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+# tests/test_006.py
+
+import pytest
+import unittest
+import contextlib
+from unittest import mock
+from tlaloc_cdn_builder import builder
+from tlaloc_cdn_builder.edge_functions import edge_functions
+
+
+@pytest.mark.usefixtures("builder_config")
+class TestTriggers(unittest.TestCase):
+
+    def config(self, triggers=None, **parameters):
+        origin = {"type": "apigateway", "domain_name": "api.example.com", "mask": "/api/*"}
+        if triggers is not None:
+            origin["triggers"] = triggers
+        parameters.setdefault("aws_origins", [{"type": "s3", "name": "test", "default": True}, origin])
+        return self.builder_config(**parameters)
+
+    def test_defaults(self):
+        cdn = builder(self.config())
+        self.assertEqual(
+            cdn.config["aws_origins"][0]["triggers"],
+            [{"function": "s3-origin-request", "event_type": "origin-request", "include_body": True}],
+        )
+        self.assertEqual(
+            [trigger["function"] for trigger in cdn.config["aws_origins"][1]["triggers"]],
+            ["viewer-request", "api-origin-request"],
+        )
+
+        # api-origin-response is only attached on request
+        for cdn in [
+            builder(self.config(aws_syslog_responses=True)),
+            builder(
+                self.config(
+                    aws_origins=[
+                        {
+                            "type": "apigateway",
+                            "domain_name": "api.example.com",
+                            "mask": "/api/*",
+                            "origin_response": True,
+                        }
+                    ]
+                )
+            ),
+        ]:
+            self.assertEqual(
+                [trigger["function"] for trigger in cdn.config["aws_origins"][-1]["triggers"]],
+                ["viewer-request", "api-origin-request", "api-origin-response"],
+            )
+
+    def test_default_associations(self):
+        cdn = builder(self.config())
+        with contextlib.ExitStack() as stack:
+            for name in edge_functions:
+                stack.enter_context(mock.patch.dict(edge_functions[name], {"version": f"{name}Version"}))
+            associations = cdn._aws_function_associations(cdn.config["aws_origins"][1])
+        self.assertEqual(
+            [association["EventType"] for association in associations],
+            ["viewer-request", "origin-request"],
+        )
+
+    def test_associations(self):
+        cdn = builder(self.config([{"function": "api-origin-request", "include_body": True}]))
+        origin = cdn.config["aws_origins"][1]
+        self.assertEqual(
+            origin["triggers"],
+            [{"function": "api-origin-request", "event_type": "origin-request", "include_body": True}],
+        )
+        with mock.patch.dict(
+            edge_functions["api-origin-request"], {"version": "testFunctionVersion1"}
+        ):
+            self.assertEqual(
+                cdn._aws_function_associations(origin),
+                [
+                    {
+                        "EventType": "origin-request",
+                        "LambdaFunctionARN": {"Fn::Sub": "${testFunctionVersion1.FunctionArn}"},
+                        "IncludeBody": True,
+                    }
+                ],
+            )
+
+    def test_invalid(self):
+        for triggers in [
+            "viewer-request",
+            [{"function": "unknown"}],
+            [{"function": "viewer-request", "event_type": "unknown"}],
+            [{"function": "viewer-request"}, {"function": "viewer-request"}],
+            [{"function": "api-origin-response", "include_body": True}],
+            [{"function": "viewer-request", "body": True}],
+            [{"function": "api-origin-response", "event_type": "viewer-request"}],
+            [{"function": "viewer-request", "event_type": "origin-response"}],
+        ]:
+            with self.assertRaises(ValueError):
+                builder(self.config(triggers))
+
+    def test_secondary_s3_origin(self):
+        assets = {"type": "s3", "name": "assets", "mask": "/assets/*"}
+        cdn = builder(self.config(aws_origins=[{"type": "s3", "name": "test", "default": True}, assets]))
+        self.assertEqual(cdn.config["aws_origins"][1]["triggers"], [])
+        with self.assertRaises(ValueError):
+            builder(
+                self.config(
+                    aws_origins=[
+                        {"type": "s3", "name": "test", "default": True},
+                        {**assets, "triggers": [{"function": "s3-origin-request"}]},
+                    ]
+                )
+            )
+
+    def test_event_type_limits(self):
+        with self.assertRaises(ValueError):
+            builder(
+                self.config(
+                    [{"function": "api-origin-request", "event_type": "viewer-request"}],
+                    aws_functions_memory={"api-origin-request": 256},
+                )
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,257 @@
+# tests/test_007.py
+
+import os
+import json
+import gzip
+import time
+import tempfile
+import pytest
+import unittest
+from unittest import mock
+from tlaloc_cdn_builder import builder
+from tlaloc_cdn_builder.providers import local_provider
+from tlaloc_cdn_builder.staging import parse_access_logs, summarize, evaluate
+
+fields = "#Fields: date time x-edge-location sc-bytes c-ip cs-method cs(Host) cs-uri-stem sc-status x-edge-result-type time-taken"
+
+
+def access_log(requests):
+    lines = ["#Version: 1.0", fields]
+    for seconds, result_type in requests:
+        lines.append(
+            "\t".join(
+                ["2024-01-01", "00:00:00", "GRU1", "100", "192.0.2.1", "GET", "test", "/", "200", result_type, f"{seconds:.3f}"]
+            )
+        )
+    return "\n".join(lines) + "\n"
+
+
+@pytest.mark.usefixtures("builder_config")
+class TestStaging(unittest.TestCase):
+
+    def config(self, staging, **parameters):
+        return self.builder_config(provider="local", aws_staging=staging, **parameters)
+
+    def test_summarize(self):
+        requests = list(
+            parse_access_logs(access_log([(0.01, "Hit"), (0.02, "Miss"), (0.03, "RefreshHit"), (0.04, "Error")]).splitlines())
+        )
+        self.assertEqual(requests[0], (10.0, "Hit"))
+        self.assertEqual(
+            summarize(requests, (50, 99)),
+            {"requests": 4, "hit_ratio": 0.5, "p50": 20.0, "p99": 40.0},
+        )
+
+    def test_evaluate(self):
+        thresholds = {"requests": 2, "hit_ratio": 0.1, "latency": {"p50": 1.2}}
+        primary = {"requests": 10, "hit_ratio": 0.5, "p50": 10.0}
+        report = evaluate(primary, {"requests": 10, "hit_ratio": 0.45, "p50": 11.0}, thresholds)
+        self.assertTrue(report["passed"])
+        self.assertAlmostEqual(report["differences"]["p50"], 1.1)
+        report = evaluate(primary, {"requests": 10, "hit_ratio": 0.3, "p50": 11.0}, thresholds)
+        self.assertFalse(report["checks"]["hit_ratio"])
+        report = evaluate(primary, {"requests": 1, "hit_ratio": 0.5, "p50": 10.0}, thresholds)
+        self.assertFalse(report["checks"]["requests"])
+
+    def test_check_staging(self):
+        self.assertIsNone(builder(self.config(None)).config["aws_staging"])
+        cdn = builder(self.config({"header": {"name": "aws-cf-cd-staging", "value": "true"}}))
+        self.assertEqual(cdn.config["aws_staging"]["thresholds"]["requests"], 100)
+        for staging in [
+            {},
+            {"weight": 0.05, "header": {"name": "aws-cf-cd-staging", "value": "true"}},
+            {"weight": 0.5},
+            {"header": {"name": "staging", "value": "true"}},
+            {"header": {"name": "aws-cf-cd-staging", "value": "true"}, "session_stickiness": {"idle_ttl": 300, "maximum_ttl": 300}},
+            {"weight": 0.05, "thresholds": {"latency": {"median": 1.1}}},
+        ]:
+            with self.assertRaises(ValueError):
+                builder(self.config(staging))
+
+    def test_compare(self):
+        with tempfile.TemporaryDirectory() as path:
+            cdn = builder(
+                self.config(
+                    {"weight": 0.05, "thresholds": {"requests": 4, "latency": {"p90": 1.2}}},
+                    local_path=path,
+                )
+            )
+            provider = local_provider(cdn.config)
+            for distribution, requests in [
+                ("primary", [(0.01, "Hit"), (0.02, "Hit"), (0.03, "Miss"), (0.04, "Miss")]),
+                ("staging", [(0.01, "Hit"), (0.02, "Hit"), (0.03, "Miss"), (0.09, "Miss")]),
+            ]:
+                file_path = os.path.join(path, "access.gz")
+                with open(file_path, "wb") as f:
+                    f.write(gzip.compress(access_log(requests).encode()))
+                provider.upload_file(
+                    file_path,
+                    "test-weelock-cloudfront-logs-us-east-1",
+                    f"{distribution}/E000000000000.2024-01-01-00.test.gz",
+                )
+            with self.assertRaises(ValueError):
+                cdn.compare()
+            report = cdn.compare(since=0)
+
+            # Without since only the logs written after the staging deployment are read
+            with mock.patch.object(builder, "_aws_load_record", return_value={"deployed": 2**40}):
+                self.assertEqual(cdn.compare()["staging"]["requests"], 0)
+        self.assertEqual(report["since"], 0)
+        self.assertEqual(report["staging"]["requests"], 4)
+        self.assertEqual(report["differences"]["hit_ratio"], 0)
+        self.assertFalse(report["checks"]["p90"])
+        self.assertFalse(report["passed"])
+
+    def test_promotion(self):
+        cdn = builder(self.config({"weight": 0.05}))
+        cdn.manifest = {"template": "1-test-us-east-1.json"}
+        policy = {
+            "Type": "AWS::CloudFront::ResponseHeadersPolicy",
+            "Properties": {"ResponseHeadersPolicyConfig": {"Name": "test-origin001-headers"}},
+        }
+        template = {
+            "Resources": {
+                "bucketCloudFrontLogs": {"Type": "AWS::S3::Bucket"},
+                "bucketCloudFrontLogsPolicy": {
+                    "Type": "AWS::S3::BucketPolicy",
+                    "Properties": {"PolicyDocument": {"Statement": [{"Condition": {"StringEquals": {}}}]}},
+                },
+                "domainCertificate": {"Type": "AWS::CertificateManager::Certificate"},
+                "originPolicy": policy,
+                "testFunctionVersion1": {"Type": "AWS::Lambda::Version"},
+                "cloudFrontDistribution": {
+                    "Properties": {
+                        "DistributionConfig": {
+                            "Aliases": ["test.example.com"],
+                            "CacheBehaviors": [
+                                {
+                                    "LambdaFunctionAssociations": [
+                                        {"LambdaFunctionARN": {"Fn::Sub": "${testFunctionVersion1.FunctionArn}"}}
+                                    ],
+                                    "ResponseHeadersPolicyId": {"Ref": "originPolicy"},
+                                }
+                            ],
+                            "Logging": {
+                                "Bucket": {"Fn::GetAtt": ["bucketCloudFrontLogs", "DomainName"]},
+                                "Prefix": "primary/",
+                            },
+                            "ViewerCertificate": {"AcmCertificateArn": {"Ref": "domainCertificate"}},
+                        }
+                    }
+                },
+            },
+            "Outputs": {},
+        }
+
+        # Every resource the configuration references is recorded
+        promoted = cdn._aws_promotion(
+            template, template["Resources"]["cloudFrontDistribution"]["Properties"]["DistributionConfig"]
+        )
+        self.assertEqual(
+            list(promoted["resources"]),
+            ["bucketCloudFrontLogs", "domainCertificate", "originPolicy", "testFunctionVersion1"],
+        )
+
+        # A policy changed in staging does not reach the primary distribution
+        template["Resources"]["originPolicy"] = {
+            **policy,
+            "Properties": {"ResponseHeadersPolicyConfig": {"Name": "test-origin001-headers", "Comment": "new"}},
+        }
+        cdn._aws_build_staging(template, promoted)
+        resources = template["Resources"]
+        self.assertEqual(
+            resources["originPolicyPromoted"]["Properties"]["ResponseHeadersPolicyConfig"],
+            {"Name": "test-origin001-headers-promoted"},
+        )
+        self.assertEqual(
+            resources["cloudFrontDistribution"]["Properties"]["DistributionConfig"]["CacheBehaviors"][0][
+                "ResponseHeadersPolicyId"
+            ],
+            {"Ref": "originPolicyPromoted"},
+        )
+        self.assertEqual(
+            resources["cloudFrontStagingDistribution"]["Properties"]["DistributionConfig"]["CacheBehaviors"][0][
+                "ResponseHeadersPolicyId"
+            ],
+            {"Ref": "originPolicy"},
+        )
+
+    def test_promote_failure(self):
+        directory = os.getcwd()
+        with tempfile.TemporaryDirectory() as path:
+            os.chdir(path)
+            try:
+                os.makedirs(".CDN")
+                cdn = builder(self.config({"weight": 0.05}, local_path=path))
+                cdn.built = True
+                cdn.promoted = None
+                cdn.manifest = {"template": "1-test-us-east-1.json"}
+                cdn.config["aws_template_file"] = "1-test-us-east-1.json"
+                distribution_config = {"Aliases": [], "Logging": {"Prefix": "primary/"}}
+                template = {
+                    "Resources": {
+                        "cloudFrontDistribution": {"Properties": {"DistributionConfig": distribution_config}},
+                        "cloudFrontStagingDistribution": {
+                            "Properties": {"DistributionConfig": {**distribution_config, "Staging": True}}
+                        },
+                    }
+                }
+                json.dump(template, open(".CDN/1-test-us-east-1.json", "w"))
+
+                # A deployment that does not complete leaves the promoted configuration as it was
+                with mock.patch.object(builder, "compare", return_value={"passed": True}), mock.patch.object(
+                    builder, "deploy", side_effect=ValueError("Deployment rolled back")
+                ):
+                    with self.assertRaises(ValueError):
+                        cdn.promote()
+                self.assertIsNone(cdn._aws_load_record("promoted"))
+                self.assertIsNone(cdn.promoted)
+            finally:
+                os.chdir(directory)
+
+    def test_deploy_wait(self):
+        directory = os.getcwd()
+        with tempfile.TemporaryDirectory() as path:
+            os.chdir(path)
+            try:
+                os.makedirs(".CDN")
+                cdn = builder(self.config({"weight": 0.05}, local_path=path))
+                cdn.built = True
+                cdn.promoted = None
+                cdn.manifest = {"template": "1-test-us-east-1.json"}
+                cdn.config["aws_template_file"] = "1-test-us-east-1.json"
+                distribution_config = {"Aliases": [], "Logging": {"Prefix": "primary/"}}
+                template = {
+                    "Resources": {
+                        "cloudFrontDistribution": {"Properties": {"DistributionConfig": distribution_config}},
+                        "cloudFrontStagingDistribution": {
+                            "Properties": {"DistributionConfig": {**distribution_config, "Staging": True}}
+                        },
+                    }
+                }
+                json.dump(template, open(".CDN/1-test-us-east-1.json", "w"))
+                deployments = []
+
+                def deploy(wait, status):
+                    deployments.append(wait)
+                    cdn.manifest["stack_status"] = status
+                    cdn.manifest["finished"] = time.time()
+
+                # A stack that does not complete records nothing
+                with mock.patch.object(builder, "_aws_deploy", side_effect=lambda wait: deploy(wait, "UPDATE_ROLLBACK_COMPLETE")):
+                    cdn.deploy()
+                self.assertIsNone(cdn._aws_load_record("staging"))
+                self.assertIsNone(cdn.promoted)
+
+                # The staging deployment is waited for before recording it
+                with mock.patch.object(builder, "_aws_deploy", side_effect=lambda wait: deploy(wait, "UPDATE_COMPLETE")):
+                    cdn.deploy(wait=False)
+                self.assertEqual(deployments, [True, True])
+                self.assertGreaterEqual(cdn._aws_load_record("staging")["deployed"], cdn.manifest["finished"])
+                self.assertEqual(cdn.manifest["staging_deployed"], cdn._aws_load_record("staging")["deployed"])
+            finally:
+                os.chdir(directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
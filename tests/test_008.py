@@ -0,0 +1,131 @@
+# tests/test_008.py
+
+import sys
+import json
+import types
+import pytest
+import unittest
+import importlib.util
+from unittest import mock
+from importlib.resources import files
+from botocore.exceptions import ClientError
+from tlaloc_cdn_builder import builder
+from tlaloc_cdn_builder.edge_functions import edge_functions
+
+
+def actions(role):
+    return [
+        action
+        for policy in role["Properties"]["Policies"]
+        for statement in policy["PolicyDocument"]["Statement"]
+        for action in statement["Action"]
+    ]
+
+
+@pytest.mark.usefixtures("builder_config")
+class TestSyslogSink(unittest.TestCase):
+
+    def test_role(self):
+        function = {
+            **edge_functions["api-origin-request"],
+            "path_sources": files("tlaloc_cdn_builder.functions").joinpath("api-origin-request"),
+        }
+        for sink in ["sqs", "batch"]:
+            role = builder(self.builder_config(aws_syslog_sink=sink))._aws_role(function)
+            self.assertEqual(actions(role).count("sqs:SendMessage"), 1)
+        role = builder(self.builder_config(aws_syslog_sink="cloudwatch"))._aws_role(function)
+        self.assertFalse([action for action in actions(role) if action.startswith("sqs:")])
+        self.assertIn("logs:PutLogEvents", actions(role))
+
+    def test_edge_regions(self):
+        cdn = builder(self.builder_config(aws_syslog_sink="cloudwatch"))
+        self.assertIn("eu-west-1", cdn.config["aws_edge_regions"])
+        for regions in [[], "us-east-1", ["us-east-1", ""]]:
+            with self.assertRaises(ValueError):
+                builder(self.builder_config(aws_syslog_sink="cloudwatch", aws_edge_regions=regions))
+
+    def test_stack_set(self):
+        cdn = builder(
+            self.builder_config(aws_syslog_sink="cloudwatch", aws_edge_regions=["us-east-1", "eu-west-1"])
+        )
+        template = {"Resources": {}}
+        with mock.patch.dict(
+            edge_functions["api-origin-request"],
+            {"name": "api-origin-request", "hash": "a1", "version": "a1FunctionVersion1"},
+        ), mock.patch.dict(
+            edge_functions["api-origin-response"],
+            {"name": "api-origin-response", "hash": "b2"},
+        ):
+            cdn._aws_syslog_stack_set(template)
+        (name, stack_set), = template["Resources"].items()
+        self.assertEqual(stack_set["Type"], "AWS::CloudFormation::StackSet")
+        self.assertEqual(
+            stack_set["Properties"]["StackInstancesGroup"][0]["Regions"], ["us-east-1", "eu-west-1"]
+        )
+
+        # Only the deployed functions writing syslog are subscribed
+        resources = json.loads(stack_set["Properties"]["TemplateBody"])["Resources"]
+        processor = name.removesuffix("StackSet")
+        log_groups = [
+            logical_id.removesuffix("Function")
+            for logical_id, resource in resources.items()
+            if resource["Type"] == "AWS::Lambda::Function"
+            and resource["Properties"]["Runtime"].startswith("python")
+        ][0]
+        self.assertEqual(
+            resources["a1FunctionLogGroup"]["Properties"],
+            {
+                "ServiceToken": {"Fn::GetAtt": [f"{log_groups}Function", "Arn"]},
+                "LogGroupName": "/aws/lambda/us-east-1.test-a1-api-origin-request",
+            },
+        )
+        self.assertEqual(resources["a1FunctionLogGroup"]["Type"], "Custom::LogGroup")
+        self.assertEqual(
+            resources["a1FunctionSubscriptionFilter"]["Properties"]["DestinationArn"],
+            {"Fn::GetAtt": [f"{processor}Function", "Arn"]},
+        )
+        self.assertEqual(
+            resources["a1FunctionSubscriptionFilter"]["DependsOn"], [f"{processor}FunctionPermission"]
+        )
+        self.assertEqual(
+            resources[f"{processor}FunctionPermission"]["Properties"]["Principal"], "logs.amazonaws.com"
+        )
+        self.assertIn("ZipFile", resources[f"{processor}Function"]["Properties"]["Code"])
+        self.assertNotIn("b2FunctionLogGroup", resources)
+
+    def test_log_groups(self):
+        cfnresponse = types.SimpleNamespace(SUCCESS="SUCCESS", FAILED="FAILED", send=mock.Mock())
+        with mock.patch.dict(sys.modules, {"cfnresponse": cfnresponse}):
+            spec = importlib.util.spec_from_file_location(
+                "syslog_log_groups",
+                files("tlaloc_cdn_builder.functions").joinpath("syslog-log-groups", "index.py"),
+            )
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+
+        def request(request_type, error=None):
+            event = {"RequestType": request_type, "ResourceProperties": {"LogGroupName": "/aws/lambda/test"}}
+            cfnresponse.send.reset_mock()
+            with mock.patch.object(module.boto3, "client") as client:
+                if error:
+                    client.return_value.create_log_group.side_effect = ClientError(
+                        {"Error": {"Code": error, "Message": error}}, "CreateLogGroup"
+                    )
+                module.handler(event, None)
+            (_, _, status, _, physical_id), _ = cfnresponse.send.call_args
+            self.assertEqual(physical_id, "/aws/lambda/test")
+            return status, client.return_value.create_log_group.call_count
+
+        self.assertEqual(request("Create"), ("SUCCESS", 1))
+
+        # A group Lambda@Edge already created in the region is taken over
+        self.assertEqual(request("Create", "ResourceAlreadyExistsException"), ("SUCCESS", 1))
+        self.assertEqual(request("Update", "ResourceAlreadyExistsException"), ("SUCCESS", 1))
+        self.assertEqual(request("Create", "AccessDeniedException"), ("FAILED", 1))
+
+        # The group is kept when the stack is deleted
+        self.assertEqual(request("Delete"), ("SUCCESS", 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+# tests/test_009.py
+
+import os
+import shutil
+import tempfile
+import pytest
+import unittest
+from importlib.resources import files
+from tlaloc_cdn_builder import builder
+
+
+@pytest.mark.usefixtures("builder_config")
+class TestCache(unittest.TestCase):
+
+    def test_attributes_cache_disabled(self):
+        cdn = builder(self.builder_config(aws_cache_ttl=0))
+        self.assertEqual(cdn.config["aws_config_ttl"], 60)
+        with tempfile.TemporaryDirectory() as path:
+            file_path = os.path.join(path, "index.mjs")
+            shutil.copy(files("tlaloc_cdn_builder.functions").joinpath("viewer-request", "index.mjs"), file_path)
+            cdn._replace_mjs(file_path)
+            source = open(file_path).read()
+
+        # Access tokens are checked on every request while the config of the user stays cached
+        self.assertIn("const cacheTtl = Number('0') * 1000;", source)
+        self.assertIn("const configTtl = Number('60') * 1000;", source)
+        self.assertIn("new TtlCache(cacheSize, configTtl)", source)
+
+    def test_invalid(self):
+        for parameter in ["aws_cache_ttl", "aws_config_ttl", "aws_cache_size", "aws_permissions_ttl"]:
+            # Booleans would be rendered as Number('True') in the functions
+            for value in [-1, 1.5, "60", True, False]:
+                with self.assertRaises(ValueError):
+                    builder(self.builder_config(**{parameter: value}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,4 @@
 from .builder import builder
+from .harness import harness
 
-__all__ = ["builder"]
+__all__ = ["builder", "harness"]
@@ -1,11 +1,29 @@
 import os
+import re
+import copy
+import gzip
 import time
 import json
-import boto3
+import base64
+import hashlib
+
+from concurrent.futures import ThreadPoolExecutor
 
 from importlib.resources import files
 from tlaloc_commons import commons  # type: ignore
-from .edge_functions import edge_functions
+from .edge_functions import (
+    edge_functions,
+    regional_functions,
+    event_types,
+    syslog_sinks,
+    edge_regions,
+    cors_methods,
+    frame_options,
+    referrer_policies,
+)
+from .harness import sdk_packages, stub_packages
+from .providers import providers
+from .staging import default_thresholds, parse_access_logs, summarize, evaluate
 
 
 class builder:
@@ -15,16 +33,38 @@ class builder:
     Parameters:
         config (dict): A dictionary with the following parameters:
             deployer (str): The name of the deployer
-            provider (str): The name of the provider if set to aws, the following parameters are required:
+            provider (str): The name of the provider, aws deploys to AWS and local stores artifacts and deployments in a local folder, both require:
 
-                aws_profile (str): The name of the AWS profile to use
+                aws_profile (str): The name of the AWS profile to use, only for the aws provider
                 aws_stack (str): The name of the stack
                 aws_stack_hash (str): The hash of the stack
                 aws_region (str): The AWS region to use
                 aws_bucket (str): The name of the S3 bucket to use
                 aws_domain (str): The domain name to use
                 aws_hosted_zone_id (str): The hosted zone id to use
-                aws_origins (list): A list of origins to use
+                aws_origins (list): A list of origins to use, every origin optionally takes:
+
+                    triggers (list): The edge functions of the origin behavior, see _check_triggers (default viewer-request, api-origin-request and, when origin_response is set, api-origin-response for apigateway origins and s3-origin-request for the default s3 origin, other s3 origins have no cache behavior to take triggers)
+
+                and apigateway origins optionally take:
+
+                    response_headers (dict): The cors and security settings of the response headers policy of the origin, see _check_response_headers
+                    origin_response (bool): Whether the default triggers include api-origin-response, which replaces error bodies by a message header and writes the responses to syslog, the response headers policy already sends the CORS and security headers (default aws_syslog_responses)
+
+            and optionally:
+
+                local_path (str): The folder used as storage by the local provider (default .CDN-local)
+                local_node_modules (str): A prebuilt node_modules folder the local provider copies into the functions instead of running npm install, without it the dependencies are replaced by the tools/sdk.mjs stand-in, enough to deploy but not to run every function (default None)
+                aws_cache_ttl (int): Seconds viewer-request reuses the Cognito GetUser answer for an access token in a warm container, a token revoked or signed out in the meantime stays accepted for up to this long by each container, 0 disables it and checks every request (default 60)
+                aws_config_ttl (int): Seconds viewer-request reuses the access config of a user in a warm container, 0 disables it (default 60)
+                aws_cache_size (int): Maximum number of entries of each edge function cache (default 1000)
+                aws_permissions_ttl (int): Seconds a compiled permission index is reused by api-origin-request, 0 disables it (default 60)
+                aws_syslog_sink (str): Where the API functions write syslog, sqs waits for the queue, batch sends batches without waiting and cloudwatch logs them for the syslog-processor function of each edge region (default sqs)
+                aws_syslog_responses (bool): Whether the API responses are also written to the syslog sink, which attaches api-origin-response to the apigateway origins that do not set origin_response (default False)
+                aws_edge_regions (list): The regions where the cloudwatch sink subscribes the syslog-processor function (default the regional edge cache regions)
+                aws_functions_memory (dict): Memory in MB by edge function name, as recommended by the harness, build warns about the functions below the recommendations it is given (default the edge_functions values)
+                aws_instrument (bool): Wraps the handlers and SDK calls with timing probes writing Embedded Metric Format lines (default False)
+                aws_staging (dict): Deploys the builds to a staging distribution receiving a weight or header selected share of the traffic until promote, see _check_staging (default None)
 
     Raises:
         ValueError: If the config parameter is not a dictionary
@@ -38,8 +78,18 @@ class builder:
         ValueError: If the config parameter does not have a aws_domain parameter
         ValueError: If the config parameter does not have a aws_hosted_zone_id parameter
         ValueError: If the config parameter does not have a aws_origins parameter
+        ValueError: If the local_node_modules parameter is not a folder
+        ValueError: If the aws_cache_ttl, aws_config_ttl, aws_cache_size or aws_permissions_ttl parameters are not non negative integers
+        ValueError: If the aws_syslog_sink parameter is not a supported sink
+        ValueError: If the aws_syslog_responses parameter is not a boolean
+        ValueError: If the aws_edge_regions parameter is not a non empty list of regions
+        ValueError: If the aws_functions_memory parameter has unknown functions or memory out of the event type limits
+        ValueError: If the aws_instrument parameter is not a boolean
+        ValueError: If an apigateway origin has invalid response settings
+        ValueError: If an origin has invalid triggers
+        ValueError: If the aws_staging parameter has invalid settings
         ValueError: If the aws_region parameter is not us-east-1
-        ValueError: If the provider parameter is not aws
+        ValueError: If the provider parameter is not aws or local
     """
 
     def __init__(self, config):
@@ -91,20 +141,46 @@ class builder:
         # Storing timestamp
         self.config["timestamp"] = int(time.time())
 
-        # Checking the AWS deployment parameters ##################################
+        # Checking the local deployment parameters ################################
 
-        if self.config["provider"] == "aws":
+        if self.config["provider"] == "local":
 
-            # Checking the aws_profile parameter
+            # Checking the local_path parameter
+            self.config["local_path"] = config.get("local_path", ".CDN-local")
             if (
-                not config.get("aws_profile")
-                or not isinstance(config["aws_profile"], str)
-                or not config["aws_profile"].strip()
+                not isinstance(self.config["local_path"], str)
+                or not self.config["local_path"].strip()
             ):
                 raise ValueError(
-                    "Config must be a non empty string parameter aws_profile"
+                    "Config parameter local_path must be a non empty string"
                 )
-            self.config["aws_profile"] = config["aws_profile"]
+
+            # Checking the local_node_modules parameter
+            self.config["local_node_modules"] = config.get("local_node_modules")
+            if self.config["local_node_modules"] is not None and (
+                not isinstance(self.config["local_node_modules"], str)
+                or not os.path.isdir(self.config["local_node_modules"])
+            ):
+                raise ValueError(
+                    "Config parameter local_node_modules must be the path of a folder"
+                )
+
+        # Checking the AWS deployment parameters ##################################
+
+        # The local provider deploys the same template, so it takes the same parameters
+        if self.config["provider"] in providers:
+
+            # Checking the aws_profile parameter
+            if self.config["provider"] == "aws":
+                if (
+                    not config.get("aws_profile")
+                    or not isinstance(config["aws_profile"], str)
+                    or not config["aws_profile"].strip()
+                ):
+                    raise ValueError(
+                        "Config must be a non empty string parameter aws_profile"
+                    )
+                self.config["aws_profile"] = config["aws_profile"]
 
             # Checking the aws_stack parameter
             if (
@@ -217,9 +293,121 @@ class builder:
                     "Config must be a non empty string parameter aws_account_id"
                 )
             self.config["aws_account_id"] = config["aws_account_id"]
-            
+
+            # Checking the aws_cache_ttl parameter
+            self.config["aws_cache_ttl"] = config.get("aws_cache_ttl", 60)
+            if (
+                not isinstance(self.config["aws_cache_ttl"], int)
+                or isinstance(self.config["aws_cache_ttl"], bool)
+                or self.config["aws_cache_ttl"] < 0
+            ):
+                raise ValueError(
+                    "Config parameter aws_cache_ttl must be a non negative integer"
+                )
+
+            # Checking the aws_config_ttl parameter
+            self.config["aws_config_ttl"] = config.get("aws_config_ttl", 60)
+            if (
+                not isinstance(self.config["aws_config_ttl"], int)
+                or isinstance(self.config["aws_config_ttl"], bool)
+                or self.config["aws_config_ttl"] < 0
+            ):
+                raise ValueError(
+                    "Config parameter aws_config_ttl must be a non negative integer"
+                )
+
+            # Checking the aws_cache_size parameter
+            self.config["aws_cache_size"] = config.get("aws_cache_size", 1000)
+            if (
+                not isinstance(self.config["aws_cache_size"], int)
+                or isinstance(self.config["aws_cache_size"], bool)
+                or self.config["aws_cache_size"] < 0
+            ):
+                raise ValueError(
+                    "Config parameter aws_cache_size must be a non negative integer"
+                )
+
+            # Checking the aws_permissions_ttl parameter
+            self.config["aws_permissions_ttl"] = config.get("aws_permissions_ttl", 60)
+            if (
+                not isinstance(self.config["aws_permissions_ttl"], int)
+                or isinstance(self.config["aws_permissions_ttl"], bool)
+                or self.config["aws_permissions_ttl"] < 0
+            ):
+                raise ValueError(
+                    "Config parameter aws_permissions_ttl must be a non negative integer"
+                )
+
+            # Checking the aws_syslog_sink parameter
+            self.config["aws_syslog_sink"] = config.get("aws_syslog_sink", "sqs")
+            if self.config["aws_syslog_sink"] not in syslog_sinks:
+                raise ValueError(
+                    f"Config parameter aws_syslog_sink must be one of {", ".join(syslog_sinks)}"
+                )
+
+            # Checking the aws_syslog_responses parameter
+            self.config["aws_syslog_responses"] = config.get("aws_syslog_responses", False)
+            if not isinstance(self.config["aws_syslog_responses"], bool):
+                raise ValueError("Config parameter aws_syslog_responses must be a boolean")
+
+            # Checking the aws_edge_regions parameter
+            self.config["aws_edge_regions"] = config.get("aws_edge_regions", edge_regions)
+            if (
+                not isinstance(self.config["aws_edge_regions"], list)
+                or not self.config["aws_edge_regions"]
+                or not all(
+                    isinstance(region, str) and re.fullmatch(r"[a-z]{2}(-[a-z]+)+-\d", region)
+                    for region in self.config["aws_edge_regions"]
+                )
+            ):
+                raise ValueError(
+                    "Config parameter aws_edge_regions must be a non empty list of regions"
+                )
+
+            # Checking the aws_functions_memory parameter
+            self.config["aws_functions_memory"] = config.get("aws_functions_memory", {})
+            if not isinstance(self.config["aws_functions_memory"], dict):
+                raise ValueError(
+                    "Config parameter aws_functions_memory must be a dictionary"
+                )
+            for name, memory in self.config["aws_functions_memory"].items():
+                if name not in edge_functions:
+                    raise ValueError(
+                        f"Config parameter aws_functions_memory has an unknown function {name}"
+                    )
+                memory_max = event_types[edge_functions[name]["event_type"]]["memory_max"]
+                if not isinstance(memory, int) or not 128 <= memory <= memory_max:
+                    raise ValueError(
+                        f"Memory of function {name} must be an integer between 128 and {memory_max}"
+                    )
+
+            # Checking the aws_instrument parameter
+            self.config["aws_instrument"] = config.get("aws_instrument", False)
+            if not isinstance(self.config["aws_instrument"], bool):
+                raise ValueError("Config parameter aws_instrument must be a boolean")
+
+            # Checking the aws_staging parameter
+            self.config["aws_staging"] = self._check_staging(config.get("aws_staging"))
+
+            # Checking the response settings and triggers of the origins
+            self.config["aws_origins"] = []
+            for origin in config["aws_origins"]:
+                if not isinstance(origin, dict):
+                    raise ValueError("Config parameter aws_origins must be a list of dictionaries")
+                origin = dict(origin)
+                if origin.get("type") == "apigateway":
+                    origin["origin_response"] = origin.get(
+                        "origin_response", self.config["aws_syslog_responses"]
+                    )
+                    if not isinstance(origin["origin_response"], bool):
+                        raise ValueError("Origin parameter origin_response must be a boolean")
+                    origin["response_headers"] = self._check_response_headers(
+                        origin.get("response_headers", {})
+                    )
+                origin["triggers"] = self._check_triggers(origin)
+                self.config["aws_origins"].append(origin)
+
             # Fixed
-            self.config["aws_origins"] = config["aws_origins"]
             self.config["aws_folder"] = "CDN"
             self.config["aws_table_permissions"] = f"{self.config["deployer"]}-tlaloc-sa-east-1-permissions"
             self.config["aws_table_access"] = f"{self.config["deployer"]}-tlaloc-sa-east-1-access"
@@ -228,21 +416,38 @@ class builder:
 
             raise ValueError("Invalid provider")
 
-    def build(self):
+    def build(self, memory_recommended=None):
         """
         This function builds the CDN preparing the files
 
         Parameters:
-            None
+            memory_recommended (dict): The memory in MB recommended for each edge function by harness.recommend, the functions configured with less are reported in the manifest (default None)
 
         Returns:
             None
 
         Raises:
             ValueError: If the provider is not supported
+            ValueError: If memory_recommended is not a dictionary of edge functions
         """
 
-        if self.config["provider"] == "aws":
+        if memory_recommended is not None and (
+            not isinstance(memory_recommended, dict)
+            or any(name not in edge_functions for name in memory_recommended)
+        ):
+            raise ValueError("Parameter memory_recommended must be a dictionary of edge functions")
+
+        # Initializing the manifest of the build
+        self.manifest = {
+            "provider": self.config["provider"],
+            "stack": self.config["aws_stack"],
+            "timestamp": self.config["timestamp"],
+            "artifacts": {},
+            "timings": {"functions": {}},
+        }
+        build_start = time.perf_counter()
+
+        if self.config["provider"] in providers:
 
             self._aws_build()
 
@@ -250,8 +455,25 @@ class builder:
 
             raise ValueError("Invalid provider")
 
+        # Warning about the functions configured with less memory than the harness measured they need
+        self.manifest["memory_below_recommended"] = {}
+        for name, memory in (memory_recommended or {}).items():
+            memory_configured = self.config["aws_functions_memory"].get(
+                name, edge_functions[name]["memory"]
+            )
+            if memory_configured < memory:
+                print(
+                    f"Warning: {name} has {memory_configured} MB, the harness recommends {memory} MB"
+                )
+                self.manifest["memory_below_recommended"][name] = {
+                    "memory": memory_configured,
+                    "memory_recommended": memory,
+                }
+
         # Set the built flag to True
         self.built = True
+        self.manifest["timings"]["build"] = time.perf_counter() - build_start
+        self._write_manifest()
 
     def _aws_build(self):
         """
@@ -311,99 +533,52 @@ class builder:
             "Outputs": {},
         }
 
+        # Reading the configuration last promoted from staging
+        self.promoted = self._aws_load_record("promoted") if self.config["aws_staging"] else None
+
         # Building Functions ######################################################
 
+        # Listing the functions attached to any origin or to the promoted configuration
+        functions_referenced = {
+            trigger["function"]
+            for origin in self.config["aws_origins"]
+            for trigger in origin["triggers"]
+        } | set(self.promoted["functions"] if self.promoted else [])
+
         for function in edge_functions:
 
-              # Calculating function variable values
+            # Skipping the functions no origin uses
             edge_functions[function]["name"] = function
             function = edge_functions[function]
-            function_hash = commons.get_hash(
-                f"{self.config["aws_stack"]}-{function["name"]}"
-            )
-            function["path_sources"] = files("tlaloc_cdn_builder.functions").joinpath(
-                function["name"]
-            )
-            function_timestamp = int(
-                os.path.getmtime(f'{function["path_sources"]}/index.mjs')
-            )
-            function["path_temporal"] = f".CDN/{function_hash}"
-            role = json.load(open(os.path.join(function["path_sources"], "role.json")))
-
-            # Copying function files
-            print(f"{function["name"]} - Copying files")
-            os.system(f"cp -r {function["path_sources"]} {function["path_temporal"]}")
-            os.system(f"rm {function["path_temporal"]}/role.json")
-
-            # Installing dependencies
-            print(f"{function["name"]} - Installing dependencies")
-            return_value = os.system(
-                f"npm install --prefix {function['path_temporal']} > {function['path_temporal']}/package.log 2>&1"
-            )
-            if return_value != 0:
-                raise ValueError(f"Error building {function["name"]} function")
-
-            # Cleaning up mjs files
-            print(f"{function["name"]} - Cleaning up mjs files")
-            for file in os.listdir(function["path_temporal"]):
-                if file.endswith(".mjs"):
-                    self._clean_mjs(f"{function["path_temporal"]}/{file}")
-
-            # Replacing variables in mjs files
-            print(f"{function["name"]} - Replacing variables in mjs files")
-            for file in os.listdir(function["path_temporal"]):
-                if file.endswith(".mjs"):
-                    self._replace_mjs(f"{function["path_temporal"]}/{file}")
-
-            # Cleaning up folder
-            print(f"{function["name"]} - Cleaning up folder")
-            os.system(f"rm -rf {function["path_temporal"]}/package*")
-
-            # Zipping the source code
-            print(f"{function["name"]} - Zipping the source code")
-            os.system(
-                f"cd {function['path_temporal']} && zip -r ../../.CDN/{function_timestamp}-{function_hash}-{self.config['aws_region']}.zip . > /dev/null"
-            )
-
-            # Deleting source folder
-            print(f"{function["name"]} - Deleting source folder")
-            os.system(f"rm -rf {function["path_temporal"]}")
-
-            # Adding function resource
-            print(f"{function["name"]} - Adding function resource")
-            template["Resources"][f"{function_hash}Function"] = {
-                "Type": "AWS::Lambda::Function",
-                "Properties": {
-                    "FunctionName": f"{self.config["deployer"]}-{function_hash}-{function["name"]}",
-                    "Handler": "index.handler",
-                    "Role": {"Fn::GetAtt": [f"{function_hash}FunctionRole", "Arn"]},
-                    "Runtime": function["runtime"],
-                    "Timeout": function["timeout"],
-                    "MemorySize": function["memory"],
-                    "Code": {
-                        "S3Bucket": self.config["aws_bucket"],
-                        "S3Key": f"CDN/{function_timestamp}-{function_hash}-{self.config["aws_region"]}.zip",
-                    },
-                },
-            }
+            if function["name"] not in functions_referenced:
+                print(f"{function["name"]} - Skipping, not referenced by any origin")
+                for key in ["hash", "timestamp", "digest", "zip", "version"]:
+                    function.pop(key, None)
+                continue
 
-            # Adding function role resource
-            print(f"{function["name"]} - Adding role resource")
-            template["Resources"][f"{function_hash}FunctionRole"] = role
+            # Packaging the function
+            self._aws_build_function(template, function)
 
             # Adding function version resource
             print(f"{function["name"]} - Adding version resource")
             template["Resources"][
-                f"{function_hash}FunctionVersion{function_timestamp}"
+                f"{function["hash"]}FunctionVersion{function["timestamp"]}{function["digest"]}"
             ] = {
                 "Type": "AWS::Lambda::Version",
-                "DependsOn": f"{function_hash}Function",
+                "DependsOn": f"{function["hash"]}Function",
                 "DeletionPolicy": "Retain",
                 "Properties": {
-                    "FunctionName": {"Ref": f"{function_hash}Function"},
+                    "FunctionName": {"Ref": f"{function["hash"]}Function"},
                 },
             }
-            function["version"] = f"{function_hash}FunctionVersion{function_timestamp}"
+            function["version"] = (
+                f"{function["hash"]}FunctionVersion{function["timestamp"]}{function["digest"]}"
+            )
+
+        # Building Syslog Processors ##############################################
+
+        if self.config["aws_syslog_sink"] == "cloudwatch":
+            self._aws_syslog_stack_set(template)
 
         # Building Distribution ###################################################
 
@@ -606,49 +781,38 @@ class builder:
                         },
                     }
                 )
+                behavior = {
+                    "TargetOriginId": f"distributionOrigin{origin_id:03}Api",
+                    "PathPattern": origin["mask"],
+                    "Compress": False,
+                    "ViewerProtocolPolicy": "https-only",
+                    "CachePolicyId": "4135ea2d-6df8-44a3-9df3-4b5a84be39ad",
+                    "OriginRequestPolicyId": "b689b0a8-53d0-40ab-baf2-68738e2966ac",
+                    "AllowedMethods": [
+                        "GET",
+                        "HEAD",
+                        "OPTIONS",
+                        "PUT",
+                        "PATCH",
+                        "POST",
+                        "DELETE",
+                    ],
+                    "LambdaFunctionAssociations": self._aws_function_associations(origin),
+                }
+
+                # The static headers are added by CloudFront with a response headers policy
+                policy = self._aws_response_headers_policy(origin, origin_id)
+                if policy:
+                    template["Resources"][
+                        f"distributionOrigin{origin_id:03}ApiResponseHeadersPolicy"
+                    ] = policy
+                    behavior["ResponseHeadersPolicyId"] = {
+                        "Ref": f"distributionOrigin{origin_id:03}ApiResponseHeadersPolicy"
+                    }
+
                 template["Resources"]["cloudFrontDistribution"]["Properties"][
                     "DistributionConfig"
-                ]["CacheBehaviors"].append(
-                    {
-                        "TargetOriginId": f"distributionOrigin{origin_id:03}Api",
-                        "PathPattern": origin["mask"],
-                        "Compress": False,
-                        "ViewerProtocolPolicy": "https-only",
-                        "CachePolicyId": "4135ea2d-6df8-44a3-9df3-4b5a84be39ad",
-                        "OriginRequestPolicyId": "b689b0a8-53d0-40ab-baf2-68738e2966ac",
-                        "AllowedMethods": [
-                            "GET",
-                            "HEAD",
-                            "OPTIONS",
-                            "PUT",
-                            "PATCH",
-                            "POST",
-                            "DELETE",
-                        ],
-                        "LambdaFunctionAssociations": [
-                            {
-                                "EventType": "viewer-request",
-                                "LambdaFunctionARN": {
-                                    "Fn::Sub": f'${{{edge_functions["viewer-request"]["version"]}.FunctionArn}}'
-                                },
-                                "IncludeBody": True,
-                            },
-                            {
-                                "EventType": "origin-request",
-                                "LambdaFunctionARN": {
-                                    "Fn::Sub": f'${{{edge_functions["api-origin-request"]["version"]}.FunctionArn}}'
-                                },
-                                "IncludeBody": True,
-                            },
-                            {
-                                "EventType": "origin-response",
-                                "LambdaFunctionARN": {
-                                    "Fn::Sub": f'${{{edge_functions["api-origin-response"]["version"]}.FunctionArn}}'
-                                },
-                            },
-                        ],
-                    }
-                )
+                ]["CacheBehaviors"].append(behavior)
 
             # Adding default cache behavior
             if "default" in origin and origin["default"]:
@@ -661,31 +825,18 @@ class builder:
                         "ViewerProtocolPolicy": "redirect-to-https",
                         "CachePolicyId": "4135ea2d-6df8-44a3-9df3-4b5a84be39ad",
                         "OriginRequestPolicyId": "b689b0a8-53d0-40ab-baf2-68738e2966ac",
-                        "LambdaFunctionAssociations": [
-                            #     {
-                            #         "EventType": "viewer-request",
-                            #         "LambdaFunctionARN": {
-                            #             "Fn::Sub": f'${{{edge_functions["viewer-request"]["version"]}.FunctionArn}}'
-                            #         },
-                            #         "IncludeBody": True,
-                            #     },
-                            {
-                                "EventType": "origin-request",
-                                "LambdaFunctionARN": {
-                                    "Fn::GetAtt": [
-                                        edge_functions["s3-origin-request"]["version"],
-                                        "FunctionArn",
-                                    ]
-                                },
-                                "IncludeBody": True,
-                            },
-                        ],
+                        "LambdaFunctionAssociations": self._aws_function_associations(origin),
                     }
                 else:
                     raise ValueError("Invalid origin type for default origin")
 
             origin_id += 1
 
+        # Building Staging Distribution ###########################################
+
+        if self.config["aws_staging"]:
+            self._aws_build_staging(template, self.promoted)
+
         template["Outputs"]["cloudFrontDistribution"] = {
             "Value": {"Ref": "cloudFrontDistribution"},
             "Export": {"Name": f"{self.config["deployer"]}-cloudFrontDistribution"},
@@ -707,148 +858,1416 @@ class builder:
         self.config["aws_template_file"] = (
             f"{self.config["timestamp"]}-{self.config["aws_stack_hash"]}-{self.config["aws_region"]}.json"
         )
+        self.manifest["template"] = f"{self.config["aws_folder"]}/{self.config["aws_template_file"]}"
 
-    def deploy(self, wait=False):
+    def _check_staging(self, staging):
         """
-        This function deploys the CDN using the provider specified in the config
+        This function checks the staging settings and fills their defaults
+
+        The traffic goes to staging either by weight, a share between 0 and 0.15 of the requests
+        optionally kept on the same distribution with session_stickiness (idle_ttl and maximum_ttl
+        between 300 and 3600 seconds), or by header, a dictionary with the name, which must start
+        with aws-cf-cd-, and the value of the header. The thresholds promote requires are the minimum
+        requests of each distribution, the maximum hit ratio drop and the maximum latency ratio of
+        each percentile, see staging.default_thresholds.
 
         Parameters:
-            None
+            staging (dict): The weight or header, session_stickiness and thresholds settings, None disables staging
 
         Returns:
-            None
+            dict: The settings with their defaults, None when staging is disabled
 
         Raises:
-            ValueError: If the CDN has not been built
-            ValueError: If the provider is not supported
+            ValueError: If the settings are unknown or invalid
         """
 
-        if not self.built:
-
-            raise ValueError("You must build the CDN before deploying it")
-
-        if self.config["provider"] == "aws":
+        if staging is None:
+            return None
+        staging_defaults = {
+            "weight": None,
+            "header": None,
+            "session_stickiness": None,
+            "thresholds": {},
+        }
+        if not isinstance(staging, dict) or set(staging) - set(staging_defaults):
+            raise ValueError(
+                f"Config parameter aws_staging must be a dictionary with {", ".join(staging_defaults)}"
+            )
+        staging = {**staging_defaults, **staging}
+
+        # Checking the traffic split
+        if (staging["weight"] is None) == (staging["header"] is None):
+            raise ValueError("Staging must set either weight or header")
+        if staging["weight"] is not None and (
+            not isinstance(staging["weight"], (int, float))
+            or isinstance(staging["weight"], bool)
+            or not 0 < staging["weight"] <= 0.15
+        ):
+            raise ValueError("Staging weight must be a number greater than 0 and up to 0.15")
+        if staging["header"] is not None and (
+            not isinstance(staging["header"], dict)
+            or set(staging["header"]) != {"name", "value"}
+            or not isinstance(staging["header"]["name"], str)
+            or not staging["header"]["name"].startswith("aws-cf-cd-")
+            or not isinstance(staging["header"]["value"], str)
+            or not staging["header"]["value"].strip()
+        ):
+            raise ValueError(
+                "Staging header must have a name starting with aws-cf-cd- and a non empty value"
+            )
+        if staging["session_stickiness"] is not None:
+            session_stickiness = staging["session_stickiness"]
+            if (
+                staging["weight"] is None
+                or not isinstance(session_stickiness, dict)
+                or set(session_stickiness) != {"idle_ttl", "maximum_ttl"}
+                or not all(
+                    isinstance(value, int) and 300 <= value <= 3600
+                    for value in session_stickiness.values()
+                )
+                or session_stickiness["idle_ttl"] > session_stickiness["maximum_ttl"]
+            ):
+                raise ValueError(
+                    "Staging session_stickiness needs a weight and idle_ttl up to maximum_ttl between 300 and 3600"
+                )
 
-            self._aws_deploy(wait)
+        # Checking the promotion thresholds
+        thresholds = staging["thresholds"]
+        if not isinstance(thresholds, dict) or set(thresholds) - set(default_thresholds):
+            raise ValueError(
+                f"Staging thresholds must be a dictionary with {", ".join(default_thresholds)}"
+            )
+        thresholds = {**default_thresholds, **thresholds}
+        if not isinstance(thresholds["requests"], int) or thresholds["requests"] < 1:
+            raise ValueError("Staging threshold requests must be a positive integer")
+        if not isinstance(thresholds["hit_ratio"], (int, float)) or not 0 <= thresholds["hit_ratio"] <= 1:
+            raise ValueError("Staging threshold hit_ratio must be a number between 0 and 1")
+        if (
+            not isinstance(thresholds["latency"], dict)
+            or not thresholds["latency"]
+            or not all(
+                re.fullmatch(r"p([1-9][0-9]?)", point)
+                and isinstance(ratio, (int, float))
+                and ratio > 0
+                for point, ratio in thresholds["latency"].items()
+            )
+        ):
+            raise ValueError(
+                "Staging threshold latency must map percentiles like p90 to positive ratios"
+            )
+        staging["thresholds"] = thresholds
 
-        else:
+        return staging
 
-            raise ValueError("Invalid provider")
+    def _check_response_headers(self, response_headers):
+        """
+        This function checks the response headers settings of an apigateway origin and fills their defaults
 
-        # Set the deployed flag to True
-        self.deployed = True
+        The cors settings are allow_origins, allow_headers, allow_methods and expose_headers (lists),
+        allow_credentials and override (bool) and max_age (int), or False to send no CORS headers. Their
+        defaults allow any origin, header and method without overriding the headers of the origin. Only
+        per builds send CORS headers when the settings are not given, as api-origin-response did.
 
-    def _aws_deploy(self, wait=False):
-        """
-        This function deploys an AWS CDN using the CloudFormation template and files created by build
+        The security settings are content_security_policy (str), content_type_options (bool),
+        frame_options (str), referrer_policy (str), strict_transport_security (int max age),
+        include_subdomains, preload, xss_protection and override (bool). None is sent by default.
 
         Parameters:
-            None
+            response_headers (dict): The cors and security settings of the origin
 
         Returns:
-            None
-        """
+            dict: The cors and security settings with their defaults, cors is None when disabled
 
-        # Setting the profile and opening s3 client
-        self.aws = boto3.Session(profile_name=self.config["aws_profile"])
-
-        # Uploading files to S3
-        print("Uploading files to S3")
-        self._aws_upload()
+        Raises:
+            ValueError: If the settings are unknown or invalid
+        """
 
-        # Deploying stack
-        print("Deploying stack")
-        print(json.dumps(self.config, indent=4))
-        commons.aws.cloudformation.deploy(self, capabilities=["CAPABILITY_IAM"])
+        if not isinstance(response_headers, dict) or set(response_headers) - {"cors", "security"}:
+            raise ValueError(
+                "Origin parameter response_headers must be a dictionary with cors and security settings"
+            )
 
-        # Wait for the deployment to finish
-        if wait:
-            print("Waiting for the deployment to finish")
-            commons.aws.cloudformation.deploy_wait(self)
+        # Checking the CORS settings
+        cors = response_headers.get("cors", {} if self.config["type"] == "per" else False)
+        cors_defaults = {
+            "allow_origins": ["*"],
+            "allow_headers": ["*"],
+            "allow_methods": ["ALL"],
+            "expose_headers": [],
+            "allow_credentials": False,
+            "max_age": None,
+            "override": False,
+        }
+        if cors is False:
+            cors = None
+        elif not isinstance(cors, dict) or set(cors) - set(cors_defaults):
+            raise ValueError(
+                f"CORS settings must be False or a dictionary with {", ".join(cors_defaults)}"
+            )
+        else:
+            cors = {**cors_defaults, **cors}
+            for name in ["allow_origins", "allow_headers", "allow_methods", "expose_headers"]:
+                if (
+                    not isinstance(cors[name], list)
+                    or not all(isinstance(item, str) and item.strip() for item in cors[name])
+                    or (name != "expose_headers" and not cors[name])
+                ):
+                    raise ValueError(f"CORS setting {name} must be a list of non empty strings")
+            if set(cors["allow_methods"]) - set(cors_methods) or (
+                "ALL" in cors["allow_methods"] and len(cors["allow_methods"]) > 1
+            ):
+                raise ValueError(
+                    f"CORS setting allow_methods must be ALL or a list of {", ".join(cors_methods[:-1])}"
+                )
+            for name in ["allow_credentials", "override"]:
+                if not isinstance(cors[name], bool):
+                    raise ValueError(f"CORS setting {name} must be a boolean")
+            if cors["max_age"] is not None and (
+                not isinstance(cors["max_age"], int) or cors["max_age"] < 0
+            ):
+                raise ValueError("CORS setting max_age must be a non negative integer")
+            if cors["allow_credentials"] and "*" in cors["allow_origins"]:
+                raise ValueError("CORS credentials cannot be allowed for any origin")
+
+        # Checking the security settings
+        security = response_headers.get("security", {})
+        security_defaults = {
+            "content_security_policy": None,
+            "content_type_options": False,
+            "frame_options": None,
+            "referrer_policy": None,
+            "strict_transport_security": None,
+            "include_subdomains": False,
+            "preload": False,
+            "xss_protection": False,
+            "override": True,
+        }
+        if not isinstance(security, dict) or set(security) - set(security_defaults):
+            raise ValueError(
+                f"Security settings must be a dictionary with {", ".join(security_defaults)}"
+            )
+        security = {**security_defaults, **security}
+        for name in ["content_type_options", "include_subdomains", "preload", "xss_protection", "override"]:
+            if not isinstance(security[name], bool):
+                raise ValueError(f"Security setting {name} must be a boolean")
+        if security["content_security_policy"] is not None and (
+            not isinstance(security["content_security_policy"], str)
+            or not security["content_security_policy"].strip()
+        ):
+            raise ValueError("Security setting content_security_policy must be a non empty string")
+        if security["frame_options"] is not None and security["frame_options"] not in frame_options:
+            raise ValueError(
+                f"Security setting frame_options must be one of {", ".join(frame_options)}"
+            )
+        if (
+            security["referrer_policy"] is not None
+            and security["referrer_policy"] not in referrer_policies
+        ):
+            raise ValueError(
+                f"Security setting referrer_policy must be one of {", ".join(referrer_policies)}"
+            )
+        if security["strict_transport_security"] is not None and (
+            not isinstance(security["strict_transport_security"], int)
+            or security["strict_transport_security"] < 0
+        ):
+            raise ValueError(
+                "Security setting strict_transport_security must be a non negative integer"
+            )
 
-        # Deletes the session
-        del self.aws
+        return {"cors": cors, "security": security}
 
-    def _aws_upload(self):
+    def _check_triggers(self, origin):
         """
-        This function uploads the required files to the S3 bucket
+        This function checks the triggers of an origin and fills their defaults
+
+        Each trigger is a dictionary with the edge function name in function, the event_type it is
+        attached to (default the event type of the function) and include_body (default False), which
+        only viewer-request and origin-request support. Functions handling requests only run on request
+        events and functions handling responses on response events. An origin takes at most one trigger
+        per event type, and s3 origins only take triggers when they are the default origin, as the
+        others have no cache behavior.
 
         Parameters:
-            None
+            origin (dict): The origin, its origin_response flag selects the default triggers of apigateway origins
 
         Returns:
-            None
+            list: The triggers with their defaults
+
+        Raises:
+            ValueError: If the triggers are not a list of valid triggers
         """
 
-        # Creating the s3 client
-        s3_client = self.aws.client("s3")
+        # Defaulting to the functions the origin types always had
+        if "triggers" not in origin:
+            if origin.get("type") == "apigateway":
+                triggers = [
+                    {"function": "viewer-request", "include_body": True},
+                    {"function": "api-origin-request", "include_body": True},
+                ]
+                if origin["origin_response"]:
+                    triggers.append({"function": "api-origin-response"})
+            elif origin.get("type") == "s3" and origin.get("default"):
+                triggers = [{"function": "s3-origin-request", "include_body": True}]
+            else:
+                triggers = []
+        else:
+            triggers = origin["triggers"]
+        if not isinstance(triggers, list):
+            raise ValueError("Origin parameter triggers must be a list")
+        if triggers and origin.get("type") == "s3" and not origin.get("default"):
+            raise ValueError("Only the default s3 origin has a cache behavior to take triggers")
+
+        # Checking each trigger
+        checked = []
+        for trigger in triggers:
+            if not isinstance(trigger, dict) or set(trigger) - {"function", "event_type", "include_body"}:
+                raise ValueError(
+                    "Each trigger must be a dictionary with function, event_type and include_body"
+                )
+            if trigger.get("function") not in edge_functions:
+                raise ValueError(
+                    f"Trigger function must be one of {", ".join(edge_functions)}"
+                )
+            function = edge_functions[trigger["function"]]
+            trigger = {
+                "event_type": function["event_type"],
+                "include_body": False,
+                **trigger,
+            }
+            if trigger["event_type"] not in event_types:
+                raise ValueError(
+                    f"Trigger event_type must be one of {", ".join(event_types)}"
+                )
+            if trigger["event_type"].split("-")[1] != function["event_type"].split("-")[1]:
+                raise ValueError(
+                    f"Function {trigger["function"]} handles {function["event_type"].split("-")[1]}s and cannot run on {trigger["event_type"]}"
+                )
+            if trigger["event_type"] in [item["event_type"] for item in checked]:
+                raise ValueError(
+                    f"Origin has more than one trigger for {trigger["event_type"]}"
+                )
+            if not isinstance(trigger["include_body"], bool):
+                raise ValueError("Trigger include_body must be a boolean")
+            if trigger["include_body"] and trigger["event_type"] not in [
+                "viewer-request",
+                "origin-request",
+            ]:
+                raise ValueError(
+                    f"Trigger include_body is not supported for {trigger["event_type"]}"
+                )
 
-        # Uploading files
-        print(f"Uploading files")
-        for file in os.listdir(f".CDN/"):
-            if file.endswith(".zip"):
-                print(f"Uploading {file}")
-                s3_client.upload_file(
-                    f".CDN/{file}",
-                    self.config["aws_bucket"],
-                    f"CDN/{file}",
+            # Checking the function fits the limits of the event type
+            memory = self.config["aws_functions_memory"].get(
+                trigger["function"], function["memory"]
+            )
+            if (
+                memory > event_types[trigger["event_type"]]["memory_max"]
+                or function["timeout"] > event_types[trigger["event_type"]]["timeout_max"]
+            ):
+                raise ValueError(
+                    f"Function {trigger["function"]} exceeds the limits of {trigger["event_type"]}"
                 )
+            checked.append(trigger)
 
-        # Upload the API template to S3
-        s3_client.upload_file(
-            f".CDN/{self.config["timestamp"]}-{self.config["aws_stack_hash"]}-{self.config["aws_region"]}.json",
-            self.config["aws_bucket"],
-            f"CDN/{self.config["timestamp"]}-{self.config["aws_stack_hash"]}-{self.config["aws_region"]}.json",
-        )
+        return checked
 
-        # Closing the s3 client
-        s3_client.close()
+    def _aws_function_associations(self, origin):
+        """
+        This function creates the Lambda function associations of an origin behavior from its triggers
 
-    def _clean_mjs(self, file_path):
+        Parameters:
+            origin (dict): The origin with its checked triggers
 
-        # Initialize the file_clean string and the rules list
-        file_clean = ""
-        rules = []
+        Returns:
+            list: The LambdaFunctionAssociations of the behavior
+        """
 
-        # Read the file and apply the rules
-        with open(file_path, "r") as f:
-            for line in f:
-                line_strip = line.strip()
-                if line_strip.startswith("//// IF"):
-                    line_split = line_strip.split(" ")
-                    rule = [line_split[2], "==", line_split[3]]
-                    if rule in rules:
-                        raise ValueError("Rule is already in use")
-                    rules.append(rule)
-                elif line_strip.startswith("//// ENDIF"):
-                    if len(rules) == 0:
-                        raise ValueError("No rule to close")
-                    rules.pop()
-                else:
-                    write = True
-                    for rule in rules:
-                        if rule[1] == "==" and self.config[rule[0]] == rule[2]:
-                            continue
-                        else:
-                            write = False
-                            break
-                    if write:
-                        file_clean += line
+        associations = []
+        for trigger in origin["triggers"]:
+            association = {
+                "EventType": trigger["event_type"],
+                "LambdaFunctionARN": {
+                    "Fn::Sub": f'${{{edge_functions[trigger["function"]]["version"]}.FunctionArn}}'
+                },
+            }
+            if trigger["include_body"]:
+                association["IncludeBody"] = True
+            associations.append(association)
 
-        # Write the cleaned file
-        with open(file_path, "w") as f:
-            f.write(file_clean)
+        return associations
 
-    def _replace_mjs(self, file_path):
+    def _aws_response_headers_policy(self, origin, origin_id):
+        """
+        This function creates the response headers policy resource of an apigateway origin
 
-        # Read the file and apply the rules
-        with open(file_path, "r") as f:
-            file_content = f.read()
+        Parameters:
+            origin (dict): The origin with its checked response_headers settings
+            origin_id (int): The position of the origin in aws_origins
 
-        # Replace the variables
-        for key in self.config:
-            file_content = file_content.replace(f"<<<{key}>>>", str(self.config[key]))
+        Returns:
+            dict: The AWS::CloudFront::ResponseHeadersPolicy resource, None if the origin sends no headers
+        """
 
-        # Write the cleaned file
+        policy_config = {
+            "Name": f"{self.config["aws_stack"]}-origin{origin_id:03}-headers",
+            "Comment": f"Response headers of {origin["domain_name"]}",
+        }
+
+        # Adding the CORS headers
+        cors = origin["response_headers"]["cors"]
+        if cors:
+            policy_config["CorsConfig"] = {
+                "AccessControlAllowCredentials": cors["allow_credentials"],
+                "AccessControlAllowHeaders": {"Items": cors["allow_headers"]},
+                "AccessControlAllowMethods": {"Items": cors["allow_methods"]},
+                "AccessControlAllowOrigins": {"Items": cors["allow_origins"]},
+                "OriginOverride": cors["override"],
+            }
+            if cors["expose_headers"]:
+                policy_config["CorsConfig"]["AccessControlExposeHeaders"] = {
+                    "Items": cors["expose_headers"]
+                }
+            if cors["max_age"] is not None:
+                policy_config["CorsConfig"]["AccessControlMaxAgeSec"] = cors["max_age"]
+
+        # Adding the security headers
+        security = origin["response_headers"]["security"]
+        security_config = {}
+        if security["content_security_policy"]:
+            security_config["ContentSecurityPolicy"] = {
+                "ContentSecurityPolicy": security["content_security_policy"],
+                "Override": security["override"],
+            }
+        if security["content_type_options"]:
+            security_config["ContentTypeOptions"] = {"Override": security["override"]}
+        if security["frame_options"]:
+            security_config["FrameOptions"] = {
+                "FrameOption": security["frame_options"],
+                "Override": security["override"],
+            }
+        if security["referrer_policy"]:
+            security_config["ReferrerPolicy"] = {
+                "ReferrerPolicy": security["referrer_policy"],
+                "Override": security["override"],
+            }
+        if security["strict_transport_security"] is not None:
+            security_config["StrictTransportSecurity"] = {
+                "AccessControlMaxAgeSec": security["strict_transport_security"],
+                "IncludeSubdomains": security["include_subdomains"],
+                "Preload": security["preload"],
+                "Override": security["override"],
+            }
+        if security["xss_protection"]:
+            security_config["XSSProtection"] = {
+                "ModeBlock": True,
+                "Protection": True,
+                "Override": security["override"],
+            }
+        if security_config:
+            policy_config["SecurityHeadersConfig"] = security_config
+
+        if "CorsConfig" not in policy_config and "SecurityHeadersConfig" not in policy_config:
+            return None
+
+        return {
+            "Type": "AWS::CloudFront::ResponseHeadersPolicy",
+            "Properties": {"ResponseHeadersPolicyConfig": policy_config},
+        }
+
+    def _aws_build_staging(self, template, promoted):
+        """
+        This function adds the staging distribution and its continuous deployment policy to the template
+
+        The staging distribution gets the configuration of this build while the primary one keeps the
+        configuration last promoted, or this build one when nothing has been promoted yet
+
+        Parameters:
+            template (dict): The CloudFormation template being built
+            promoted (dict): The promoted configuration, None when nothing has been promoted yet
+
+        Returns:
+            None
+        """
+
+        # Adding staging distribution resource
+        print("Adding staging distribution resources")
+        primary = template["Resources"]["cloudFrontDistribution"]["Properties"]
+        staging_config = copy.deepcopy(primary["DistributionConfig"])
+        staging_config["Staging"] = True
+        staging_config.pop("Aliases")
+        staging_config["ViewerCertificate"] = {"CloudFrontDefaultCertificate": True}
+        staging_config["Logging"]["Prefix"] = "staging/"
+        template["Resources"]["cloudFrontStagingDistribution"] = {
+            "Type": "AWS::CloudFront::Distribution",
+            "DependsOn": ["bucketCloudFrontLogs"],
+            "Properties": {"DistributionConfig": staging_config},
+        }
+
+        # Adding continuous deployment policy resource
+        if self.config["aws_staging"]["weight"] is not None:
+            traffic_config = {
+                "Type": "SingleWeight",
+                "SingleWeightConfig": {"Weight": self.config["aws_staging"]["weight"]},
+            }
+            if self.config["aws_staging"]["session_stickiness"]:
+                traffic_config["SingleWeightConfig"]["SessionStickinessConfig"] = {
+                    "IdleTTL": self.config["aws_staging"]["session_stickiness"]["idle_ttl"],
+                    "MaximumTTL": self.config["aws_staging"]["session_stickiness"]["maximum_ttl"],
+                }
+        else:
+            traffic_config = {
+                "Type": "SingleHeader",
+                "SingleHeaderConfig": {
+                    "Header": self.config["aws_staging"]["header"]["name"],
+                    "Value": self.config["aws_staging"]["header"]["value"],
+                },
+            }
+        template["Resources"]["cloudFrontContinuousDeploymentPolicy"] = {
+            "Type": "AWS::CloudFront::ContinuousDeploymentPolicy",
+            "Properties": {
+                "ContinuousDeploymentPolicyConfig": {
+                    "Enabled": True,
+                    "StagingDistributionDnsNames": [
+                        {"Fn::GetAtt": ["cloudFrontStagingDistribution", "DomainName"]}
+                    ],
+                    "TrafficConfig": traffic_config,
+                }
+            },
+        }
+
+        # Keeping the promoted configuration in the primary distribution
+        if promoted:
+            print("Keeping the promoted configuration in the primary distribution")
+            distribution_config = json.dumps(promoted["distribution_config"])
+            for logical_id, resource in promoted["resources"].items():
+                current = template["Resources"].get(logical_id)
+                if current is None:
+                    template["Resources"][logical_id] = resource
+
+                # A policy staging changed is kept apart for the primary distribution, the
+                # resources both distributions share keep the definition of this build
+                elif current != resource and resource["Type"] == "AWS::CloudFront::ResponseHeadersPolicy":
+                    resource = copy.deepcopy(resource)
+                    resource["Properties"]["ResponseHeadersPolicyConfig"]["Name"] += "-promoted"
+                    template["Resources"][f"{logical_id}Promoted"] = resource
+                    distribution_config = distribution_config.replace(
+                        json.dumps({"Ref": logical_id}), json.dumps({"Ref": f"{logical_id}Promoted"})
+                    )
+            primary["DistributionConfig"] = self._aws_primary_config(
+                json.loads(distribution_config)
+            )
+        else:
+            primary["DistributionConfig"] = self._aws_primary_config(
+                primary["DistributionConfig"]
+            )
+
+        # Allowing both distributions to write their logs
+        template["Resources"]["bucketCloudFrontLogsPolicy"]["Properties"]["PolicyDocument"][
+            "Statement"
+        ][0]["Condition"]["StringEquals"]["AWS:SourceArn"] = [
+            {
+                "Fn::Sub": f"arn:aws:cloudfront::${{AWS::AccountId}}:distribution/${{{distribution}}}"
+            }
+            for distribution in ["cloudFrontDistribution", "cloudFrontStagingDistribution"]
+        ]
+        template["Outputs"]["cloudFrontStagingDistribution"] = {
+            "Value": {"Ref": "cloudFrontStagingDistribution"},
+        }
+
+    def _aws_primary_config(self, distribution_config):
+        """
+        This function turns a staging distribution configuration into the primary one
+
+        Parameters:
+            distribution_config (dict): The staging or primary DistributionConfig
+
+        Returns:
+            dict: A copy with the aliases, certificate, log prefix and continuous deployment policy of the primary distribution
+        """
+
+        distribution_config = copy.deepcopy(distribution_config)
+        distribution_config.pop("Staging", None)
+        distribution_config["Aliases"] = [self.config["aws_domain"]]
+        distribution_config["ViewerCertificate"] = {
+            "AcmCertificateArn": {"Ref": "domainCertificate"},
+            "MinimumProtocolVersion": "TLSv1.2_2021",
+            "SslSupportMethod": "sni-only",
+        }
+        distribution_config["Logging"]["Prefix"] = "primary/"
+        distribution_config["ContinuousDeploymentPolicyId"] = {
+            "Ref": "cloudFrontContinuousDeploymentPolicy"
+        }
+
+        return distribution_config
+
+    def _aws_load_record(self, name):
+        """
+        This function reads a staging record of the stack from the bucket
+
+        Parameters:
+            name (str): The record, promoted for the configuration last promoted from staging or staging for the last staging deployment
+
+        Returns:
+            dict: The record, None if it has not been saved yet
+        """
+
+        provider = providers[self.config["provider"]](self.config)
+        key = f"{self.config["aws_folder"]}/{self.config["aws_stack_hash"]}-{self.config["aws_region"]}-{name}.json"
+        record = None
+        if any(item["key"] == key for item in provider.list_objects(self.config["aws_bucket"], key)):
+            record = json.loads(provider.get_object(self.config["aws_bucket"], key))
+        provider.close()
+
+        return record
+
+    def compare(self, since=None):
+        """
+        This function compares the access logs of the staging and primary distributions
+
+        Parameters:
+            since (float): Only reads the log files written after this UNIX timestamp (default the deployment of the current staging configuration)
+
+        Returns:
+            dict: The requests, hit ratio and latency percentiles of each distribution, their differences, the result of each threshold check, whether all passed and since
+
+        Raises:
+            ValueError: If staging is not enabled
+            ValueError: If since is not given and staging has not been deployed
+        """
+
+        if not self.config.get("aws_staging"):
+            raise ValueError("Staging is not enabled")
+
+        # Defaulting to the logs of the current staging configuration
+        if since is None:
+            staged = self._aws_load_record("staging")
+            if not staged:
+                raise ValueError("The staging distribution has not been deployed")
+            since = staged["deployed"]
+
+        # Reading the access logs of each distribution
+        provider = providers[self.config["provider"]](self.config)
+        bucket = f"{self.config["deployer"]}-weelock-cloudfront-logs-{self.config["aws_region"]}"
+        points = tuple(int(point[1:]) for point in self.config["aws_staging"]["thresholds"]["latency"])
+        summaries = {}
+        for distribution in ["primary", "staging"]:
+            requests = []
+            for item in provider.list_objects(bucket, f"{distribution}/"):
+                if item["last_modified"] < since:
+                    continue
+                content = provider.get_object(bucket, item["key"])
+                if item["key"].endswith(".gz"):
+                    content = gzip.decompress(content)
+                requests.extend(parse_access_logs(content.decode().splitlines()))
+            summaries[distribution] = summarize(requests, points)
+        provider.close()
+
+        # Checking the thresholds
+        report = evaluate(
+            summaries["primary"],
+            summaries["staging"],
+            self.config["aws_staging"]["thresholds"],
+        )
+        report["since"] = since
+        print(json.dumps(report, indent=4))
+
+        return report
+
+    def promote(self, since=None):
+        """
+        This function moves the staging configuration to the primary distribution when the comparison meets the thresholds
+
+        The deployment is always waited for, the promotion is only recorded for the next builds once
+        the primary distribution serves it
+
+        Parameters:
+            since (float): Only compares the log files written after this UNIX timestamp (default the deployment of the current staging configuration)
+
+        Returns:
+            dict: The comparison report with promoted set to whether the promotion was deployed
+
+        Raises:
+            ValueError: If the CDN has not been built
+            ValueError: If staging is not enabled
+            ValueError: If since is not given and staging has not been deployed
+            ValueError: If the deployment does not complete
+        """
+
+        if not self.built:
+            raise ValueError("You must build the CDN before promoting it")
+
+        # Comparing the distributions
+        report = self.compare(since)
+        report["promoted"] = False
+        if not report["passed"]:
+            print("Staging does not meet the thresholds, keeping the primary configuration")
+            return report
+
+        # Switching the primary distribution to the staging configuration
+        print("Promoting the staging configuration")
+        template_path = f".CDN/{self.config["aws_template_file"]}"
+        template = json.load(open(template_path))
+        promoted = self._aws_promotion(
+            template,
+            template["Resources"]["cloudFrontStagingDistribution"]["Properties"]["DistributionConfig"],
+        )
+        template["Resources"]["cloudFrontDistribution"]["Properties"][
+            "DistributionConfig"
+        ] = self._aws_primary_config(promoted["distribution_config"])
+        json.dump(template, indent=4, sort_keys=True, fp=open(template_path, "w"))
+        previous = self.promoted
+        self.promoted = promoted
+        try:
+            self.deploy(wait=True)
+            if self.manifest["stack_status"] not in ["CREATE_COMPLETE", "UPDATE_COMPLETE"]:
+                raise ValueError(
+                    f"Promotion not saved, the stack is in {self.manifest["stack_status"]}"
+                )
+        except Exception:
+            self.promoted = previous
+            raise
+
+        # Saving the promoted configuration for the next builds
+        self._aws_save_record("promoted", promoted)
+        report["promoted"] = True
+
+        return report
+
+    def _aws_promotion(self, template, distribution_config):
+        """
+        This function records a distribution configuration and the resources it uses for promotion
+
+        Parameters:
+            template (dict): The CloudFormation template of the build
+            distribution_config (dict): The DistributionConfig being promoted
+
+        Returns:
+            dict: The distribution_config, the resources and functions it uses and the template it comes from
+        """
+
+        distribution_config = copy.deepcopy(distribution_config)
+        distribution_config.pop("Staging", None)
+
+        # Listing the resources referenced by Ref, Fn::GetAtt and Fn::Sub, pseudo parameters excluded
+        dumped = json.dumps(distribution_config)
+        versions = set(re.findall(r"\$\{(\w+)\.FunctionArn\}", dumped))
+        referenced = (
+            set(re.findall(r'"Ref": "(\w+)"', dumped))
+            | set(re.findall(r'"Fn::GetAtt": \["(\w+)"', dumped))
+            | set(re.findall(r"\$\{(\w+)(?:\.\w+)?\}", dumped))
+        )
+
+        return {
+            "template": self.manifest["template"],
+            "distribution_config": distribution_config,
+            "resources": {
+                logical_id: template["Resources"][logical_id]
+                for logical_id in sorted(referenced)
+                if logical_id in template["Resources"]
+            },
+            "functions": sorted(
+                function["name"]
+                for function in edge_functions.values()
+                if function.get("version") in versions
+            ),
+        }
+
+    def _aws_save_record(self, name, record):
+        """
+        This function saves a staging record of the stack for the next builds
+
+        Parameters:
+            name (str): The record, promoted or staging
+            record (dict): The content of the record
+
+        Returns:
+            None
+        """
+
+        record_file = f"{self.config["aws_stack_hash"]}-{self.config["aws_region"]}-{name}.json"
+        json.dump(record, indent=4, sort_keys=True, fp=open(f".CDN/{record_file}", "w"))
+        provider = providers[self.config["provider"]](self.config)
+        provider.upload_file(
+            f".CDN/{record_file}",
+            self.config["aws_bucket"],
+            f"{self.config["aws_folder"]}/{record_file}",
+        )
+        provider.close()
+
+    def _aws_build_function(self, template, function):
+        """
+        This function packages a function and adds its function and role resources to the template
+
+        Parameters:
+            template (dict): The CloudFormation template being built
+            function (dict): The function definition, updated with its hash, timestamp, digest and zip file
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the function dependencies cannot be installed
+        """
+
+        # Calculating function variable values
+        function_start = time.perf_counter()
+        function_hash = commons.get_hash(
+            f"{self.config["aws_stack"]}-{function["name"]}"
+        )
+        function["path_sources"] = files("tlaloc_cdn_builder.functions").joinpath(
+            function["name"]
+        )
+        function_timestamp = max(
+            int(os.path.getmtime(os.path.join(path, file)))
+            for path, _, path_files in os.walk(function["path_sources"])
+            for file in path_files
+        )
+        function["path_temporal"] = f".CDN/{function_hash}"
+        function["hash"] = function_hash
+        function["timestamp"] = function_timestamp
+        role = self._aws_role(function)
+
+        # Copying function files
+        print(f"{function["name"]} - Copying files")
+        os.system(f"cp -r {function["path_sources"]} {function["path_temporal"]}")
+        os.system(f"rm {function["path_temporal"]}/role.json")
+
+        # Installing dependencies, the local provider builds without network
+        if self.config["provider"] == "local":
+            print(f"{function["name"]} - Copying local dependencies")
+            if self.config["local_node_modules"]:
+                os.system(
+                    f"cp -r {self.config["local_node_modules"]} {function["path_temporal"]}/node_modules"
+                )
+            else:
+                dependencies = json.load(
+                    open(f"{function["path_temporal"]}/package.json")
+                ).get("dependencies", {})
+                stub_packages(function["path_temporal"], sorted(set(dependencies) | set(sdk_packages)))
+        else:
+            print(f"{function["name"]} - Installing dependencies")
+            return_value = os.system(
+                f"npm install --prefix {function['path_temporal']} > {function['path_temporal']}/package.log 2>&1"
+            )
+            if return_value != 0:
+                raise ValueError(f"Error building {function["name"]} function")
+
+        # Cleaning up mjs files
+        print(f"{function["name"]} - Cleaning up mjs files")
+        for file in os.listdir(function["path_temporal"]):
+            if file.endswith(".mjs"):
+                self._clean_mjs(f"{function["path_temporal"]}/{file}")
+
+        # Replacing variables in mjs files
+        print(f"{function["name"]} - Replacing variables in mjs files")
+        for file in os.listdir(function["path_temporal"]):
+            if file.endswith(".mjs"):
+                self._replace_mjs(f"{function["path_temporal"]}/{file}")
+
+        # Instrumenting mjs files
+        if self.config["aws_instrument"]:
+            print(f"{function["name"]} - Instrumenting mjs files")
+            for file in os.listdir(function["path_temporal"]):
+                if file.endswith(".mjs"):
+                    self._instrument_mjs(
+                        f"{function["path_temporal"]}/{file}", function["name"]
+                    )
+            os.system(
+                f"cp {files("tlaloc_cdn_builder.tools").joinpath("probe.mjs")} {function["path_temporal"]}/probe.mjs"
+            )
+
+        # Cleaning up folder
+        print(f"{function["name"]} - Cleaning up folder")
+        os.system(f"rm -rf {function["path_temporal"]}/package*")
+
+        # Naming the package after its content, the build parameters change the code of the same sources
+        function["digest"] = self._digest(function["path_temporal"])
+        function["zip"] = (
+            f"{function_timestamp}-{function_hash}-{function["digest"]}-{self.config["aws_region"]}.zip"
+        )
+
+        # Zipping the source code
+        print(f"{function["name"]} - Zipping the source code")
+        os.system(
+            f"cd {function['path_temporal']} && zip -r ../../.CDN/{function['zip']} . > /dev/null"
+        )
+
+        # Deleting source folder
+        print(f"{function["name"]} - Deleting source folder")
+        os.system(f"rm -rf {function["path_temporal"]}")
+
+        # Registering the artifact in the manifest
+        self.manifest["artifacts"][function["zip"]] = self._artifact(
+            f".CDN/{function["zip"]}"
+        )
+        self.manifest["timings"]["functions"][function["name"]] = (
+            time.perf_counter() - function_start
+        )
+
+        # Adding function resource
+        print(f"{function["name"]} - Adding function resource")
+        template["Resources"][f"{function_hash}Function"] = {
+            "Type": "AWS::Lambda::Function",
+            "Properties": {
+                "FunctionName": f"{self.config["deployer"]}-{function_hash}-{function["name"]}",
+                "Handler": "index.handler",
+                "Role": {"Fn::GetAtt": [f"{function_hash}FunctionRole", "Arn"]},
+                "Runtime": function["runtime"],
+                "Timeout": function["timeout"],
+                "MemorySize": self.config["aws_functions_memory"].get(
+                    function["name"], function["memory"]
+                ),
+                "Code": {
+                    "S3Bucket": self.config["aws_bucket"],
+                    "S3Key": f"CDN/{function["zip"]}",
+                },
+            },
+        }
+
+        # Adding function role resource
+        print(f"{function["name"]} - Adding role resource")
+        template["Resources"][f"{function_hash}FunctionRole"] = role
+
+    def _aws_syslog_stack_set(self, template):
+        """
+        This function adds the stack set subscribing a syslog-processor function to the edge function logs of every edge region
+
+        Lambda@Edge writes its logs to the region that served the request, so each region of
+        aws_edge_regions gets a processor subscribed to the log groups of the functions writing
+        syslog. Lambda@Edge creates those groups on the first invocation of a region, so they are
+        created by the syslog-log-groups custom resource function, which keeps existing groups and
+        never deletes them. The functions are inlined, as they cannot be created from a bucket of
+        another region. The stack set is self managed through the
+        AWSCloudFormationStackSetAdministrationRole and AWSCloudFormationStackSetExecutionRole roles,
+        which must exist in the account.
+
+        Parameters:
+            template (dict): The CloudFormation template being built, with the edge functions already added
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the code of a regional function is too long to be inlined
+        """
+
+        # Adding regional function resources
+        regional_template = {
+            "AWSTemplateFormatVersion": "2010-09-09",
+            "Parameters": {"parQueueAccessLog": {"Type": "String"}},
+            "Resources": {},
+        }
+        processor = self._aws_regional_function(regional_template, "syslog-processor")
+        log_groups = self._aws_regional_function(regional_template, "syslog-log-groups")
+        regional_template["Resources"][f"{processor["hash"]}FunctionPermission"] = {
+            "Type": "AWS::Lambda::Permission",
+            "Properties": {
+                "Action": "lambda:InvokeFunction",
+                "FunctionName": {"Ref": f"{processor["hash"]}Function"},
+                "Principal": "logs.amazonaws.com",
+                "SourceAccount": {"Ref": "AWS::AccountId"},
+            },
+        }
+
+        # Subscribing the processor to the log group of the functions writing syslog
+        for function in edge_functions.values():
+            if not function.get("syslog") or "version" not in function:
+                continue
+            print(f"{function["name"]} - Adding syslog subscription resources")
+            regional_template["Resources"][f"{function["hash"]}FunctionLogGroup"] = {
+                "Type": "Custom::LogGroup",
+                "Properties": {
+                    "ServiceToken": {"Fn::GetAtt": [f"{log_groups["hash"]}Function", "Arn"]},
+                    "LogGroupName": f"/aws/lambda/{self.config["aws_region"]}.{self.config["deployer"]}-{function["hash"]}-{function["name"]}",
+                },
+            }
+            regional_template["Resources"][f"{function["hash"]}FunctionSubscriptionFilter"] = {
+                "Type": "AWS::Logs::SubscriptionFilter",
+                "DependsOn": [f"{processor["hash"]}FunctionPermission"],
+                "Properties": {
+                    "DestinationArn": {"Fn::GetAtt": [f"{processor["hash"]}Function", "Arn"]},
+                    "FilterPattern": '"SYSLOG"',
+                    "LogGroupName": {"Ref": f"{function["hash"]}FunctionLogGroup"},
+                },
+            }
+
+        # Adding stack set resource
+        template["Resources"][f"{processor["hash"]}StackSet"] = {
+            "Type": "AWS::CloudFormation::StackSet",
+            "Properties": {
+                "StackSetName": f"{self.config["aws_stack"]}-{processor["name"]}",
+                "PermissionModel": "SELF_MANAGED",
+                "Capabilities": ["CAPABILITY_IAM"],
+                "Parameters": [
+                    {
+                        "ParameterKey": "parQueueAccessLog",
+                        "ParameterValue": {"Ref": "parQueueAccessLog"},
+                    }
+                ],
+                "OperationPreferences": {
+                    "FailureToleranceCount": 0,
+                    "MaxConcurrentPercentage": 100,
+                    "RegionConcurrencyType": "PARALLEL",
+                },
+                "StackInstancesGroup": [
+                    {
+                        "DeploymentTargets": {"Accounts": [{"Ref": "AWS::AccountId"}]},
+                        "Regions": self.config["aws_edge_regions"],
+                    }
+                ],
+                "TemplateBody": json.dumps(regional_template, sort_keys=True),
+            },
+        }
+
+    def _aws_regional_function(self, regional_template, name):
+        """
+        This function adds the role and function resources of an inlined regional function to a regional template
+
+        Parameters:
+            regional_template (dict): The template deployed to every edge region
+            name (str): The name of the function in regional_functions
+
+        Returns:
+            dict: The function definition, with its hash
+
+        Raises:
+            ValueError: If the function code is too long to be inlined
+        """
+
+        # Loading the function
+        function = regional_functions[name]
+        function["name"] = name
+        function["hash"] = commons.get_hash(f"{self.config["aws_stack"]}-{name}")
+        function["path_sources"] = files("tlaloc_cdn_builder.functions").joinpath(name)
+        code = function["path_sources"].joinpath(function["source"]).read_text()
+        if len(code) > 4096:
+            raise ValueError(f"The {name} code exceeds the 4096 characters CloudFormation inlines")
+
+        # Adding function resources
+        print(f"{name} - Adding regional resources")
+        regional_template["Resources"][f"{function["hash"]}FunctionRole"] = self._aws_role(function)
+        regional_template["Resources"][f"{function["hash"]}Function"] = {
+            "Type": "AWS::Lambda::Function",
+            "Properties": {
+                "FunctionName": f"{self.config["deployer"]}-{function["hash"]}-{name}",
+                "Handler": "index.handler",
+                "Role": {"Fn::GetAtt": [f"{function["hash"]}FunctionRole", "Arn"]},
+                "Runtime": function["runtime"],
+                "Timeout": function["timeout"],
+                "MemorySize": function["memory"],
+                "Code": {"ZipFile": code},
+            },
+        }
+
+        return function
+
+    def _aws_role(self, function):
+        """
+        This function loads the role of a function, applying the rules of its role.json as in the mjs files
+
+        Parameters:
+            function (dict): The function definition
+
+        Returns:
+            dict: The role resource
+        """
+
+        with open(os.path.join(function["path_sources"], "role.json")) as f:
+            return json.loads(self._clean_rules(f))
+
+    def deploy(self, wait=False):
+        """
+        This function deploys the CDN using the provider specified in the config
+
+        With aws_staging the deployment is always waited for, so the staging record gets the time the
+        staging distribution started serving the new configuration
+
+        Parameters:
+            wait (bool): Whether to wait for the deployment to finish (default False)
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the CDN has not been built
+            ValueError: If the provider is not supported
+        """
+
+        if not self.built:
+
+            raise ValueError("You must build the CDN before deploying it")
+
+        # The comparison only reads the logs written once the staging configuration is deployed
+        if self.config["aws_staging"]:
+            wait = True
+
+        if self.config["provider"] in providers:
+
+            self._aws_deploy(wait)
+
+        else:
+
+            raise ValueError("Invalid provider")
+
+        # Set the deployed flag to True
+        self.deployed = True
+
+        # A stack that did not complete keeps serving the recorded configurations
+        if self.config["aws_staging"] and self.manifest["stack_status"] in [
+            "CREATE_COMPLETE",
+            "UPDATE_COMPLETE",
+        ]:
+            template = json.load(open(f".CDN/{self.config["aws_template_file"]}"))
+
+            # Recording when the staging configuration changed, the comparison reads the logs written since
+            staging_config = template["Resources"]["cloudFrontStagingDistribution"]["Properties"][
+                "DistributionConfig"
+            ]
+            digest = hashlib.sha256(json.dumps(staging_config, sort_keys=True).encode()).hexdigest()
+            staged = self._aws_load_record("staging")
+            if not staged or staged["digest"] != digest:
+                staged = {
+                    "template": self.manifest["template"],
+                    "digest": digest,
+                    "deployed": time.time(),
+                }
+                self._aws_save_record("staging", staged)
+            self.manifest["staging_deployed"] = staged["deployed"]
+
+            # The first staging deployment promotes the primary configuration
+            if not self.promoted:
+                self.promoted = self._aws_promotion(
+                    template,
+                    template["Resources"]["cloudFrontDistribution"]["Properties"]["DistributionConfig"],
+                )
+                self._aws_save_record("promoted", self.promoted)
+
+        self._write_manifest()
+
+    def _aws_deploy(self, wait=False):
+        """
+        This function deploys a CDN template and the files created by build using the configured provider
+
+        Parameters:
+            wait (bool): Whether to wait for the deployment to finish
+
+        Returns:
+            None
+        """
+
+        # Opening the provider
+        self.provider = providers[self.config["provider"]](self.config)
+
+        # Uploading files to the bucket
+        print("Uploading files to the bucket")
+        upload_start = time.perf_counter()
+        self._aws_upload()
+        self.manifest["timings"]["upload"] = time.perf_counter() - upload_start
+
+        # Deploying stack
+        print("Deploying stack")
+        print(json.dumps(self.config, indent=4))
+        deploy_start = time.perf_counter()
+        self.manifest["stack_status"] = self.provider.deploy(self, wait)
+        self.manifest["timings"]["deploy"] = time.perf_counter() - deploy_start
+
+        # Closing the provider
+        self.provider.close()
+        del self.provider
+
+    def _aws_upload(self):
+        """
+        This function uploads the required files to the bucket
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        """
+
+        # Uploading files, the digest matches the CodeSha256 of the function versions
+        print(f"Uploading files")
+        for file in os.listdir(f".CDN/"):
+            if file.endswith(".zip"):
+                print(f"Uploading {file}")
+                if file not in self.manifest["artifacts"]:
+                    self.manifest["artifacts"][file] = self._artifact(f".CDN/{file}")
+                self.provider.upload_file(
+                    f".CDN/{file}",
+                    self.config["aws_bucket"],
+                    f"CDN/{file}",
+                    metadata={"sha256": self.manifest["artifacts"][file]["sha256"]},
+                )
+
+        # Upload the API template to the bucket
+        self.provider.upload_file(
+            f".CDN/{self.config["timestamp"]}-{self.config["aws_stack_hash"]}-{self.config["aws_region"]}.json",
+            self.config["aws_bucket"],
+            f"CDN/{self.config["timestamp"]}-{self.config["aws_stack_hash"]}-{self.config["aws_region"]}.json",
+        )
+
+    def _digest(self, path):
+        """
+        This function calculates the digest of the files of a folder
+
+        Parameters:
+            path (str): The path of the folder
+
+        Returns:
+            str: The first 12 hexadecimal characters of the SHA-256 digest of the relative paths and contents
+        """
+
+        digest = hashlib.sha256()
+        for path_folder, folders, path_files in os.walk(path):
+            folders.sort()
+            for file in sorted(path_files):
+                path_file = os.path.join(path_folder, file)
+                with open(path_file, "rb") as f:
+                    content = f.read()
+                digest.update(f"{os.path.relpath(path_file, path)}\0{len(content)}\0".encode())
+                digest.update(content)
+
+        return digest.hexdigest()[:12]
+
+    def _artifact(self, path):
+        """
+        This function describes an artifact for the manifest
+
+        Parameters:
+            path (str): The path of the artifact
+
+        Returns:
+            dict: The size and the base64 encoded SHA-256 digest of the artifact
+        """
+
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).digest()
+
+        return {
+            "size": os.path.getsize(path),
+            "sha256": base64.b64encode(digest).decode(),
+        }
+
+    def _write_manifest(self):
+        """
+        This function saves the manifest of the build next to its template
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        """
+
+        self.config["aws_manifest_file"] = (
+            f"{self.config["timestamp"]}-{self.config["aws_stack_hash"]}-{self.config["aws_region"]}-manifest.json"
+        )
+        json.dump(
+            self.manifest,
+            indent=4,
+            sort_keys=True,
+            fp=open(f".CDN/{self.config["aws_manifest_file"]}", "w"),
+        )
+
+    def collect_garbage(self, templates=3, dry_run=True, workers=4):
+        """
+        This function deletes the artifacts of the stack that are no longer referenced from the bucket
+
+        Templates are kept when they are among the last ones of the stack, and function packages
+        when a kept template or any current or retained version of the stack functions uses them.
+        Objects of other stacks are left for their own builders.
+
+        Parameters:
+            templates (int): The number of most recent templates of the stack to keep
+            dry_run (bool): Only reports what would be deleted
+            workers (int): The number of DeleteObjects requests sent in parallel
+
+        Returns:
+            dict: The kept keys with the reason, the deleted keys, their size in bytes and the keys that could not be deleted
+
+        Raises:
+            ValueError: If the templates or workers parameters are not positive integers
+            ValueError: If the provider is not supported
+        """
+
+        if not isinstance(templates, int) or isinstance(templates, bool) or templates < 1:
+            raise ValueError("Parameter templates must be a positive integer")
+        if not isinstance(workers, int) or isinstance(workers, bool) or workers < 1:
+            raise ValueError("Parameter workers must be a positive integer")
+        if self.config["provider"] not in providers:
+            raise ValueError("Invalid provider")
+
+        # Opening the provider
+        provider = providers[self.config["provider"]](self.config)
+        bucket = self.config["aws_bucket"]
+        folder = self.config["aws_folder"]
+        region = re.escape(self.config["aws_region"])
+
+        # Classifying the objects of the stack
+        function_hashes = {
+            commons.get_hash(f"{self.config["aws_stack"]}-{name}")
+            for name in list(edge_functions) + list(regional_functions)
+        }
+        template_pattern = re.compile(
+            rf"^{re.escape(folder)}/(\d+)-{re.escape(self.config["aws_stack_hash"])}-{region}\.json$"
+        )
+        package_pattern = re.compile(
+            rf"^{re.escape(folder)}/(\d+)-(\w+)(?:-[0-9a-f]+)?-{region}\.zip$"
+        )
+        stack_templates = []
+        packages = {}
+        for item in provider.list_objects(bucket, f"{folder}/"):
+            if match := template_pattern.match(item["key"]):
+                stack_templates.append((int(match.group(1)), item))
+            elif (match := package_pattern.match(item["key"])) and match.group(2) in function_hashes:
+                packages[item["key"]] = item
+        stack_templates.sort(key=lambda entry: entry[0], reverse=True)
+
+        # Keeping the last templates and the packages they reference
+        kept = {}
+        candidates = {}
+        for position, (_, item) in enumerate(stack_templates):
+            if position >= templates:
+                candidates[item["key"]] = item
+                continue
+            kept[item["key"]] = "template"
+            template = json.loads(provider.get_object(bucket, item["key"]))
+            for resource in template.get("Resources", {}).values():
+                if resource.get("Type") == "AWS::Lambda::Function":
+                    key = resource["Properties"]["Code"]["S3Key"]
+                    if key in packages:
+                        kept[key] = f"referenced by {item["key"]}"
+
+        # Keeping the packages whose digest matches the code of a function version
+        versions = {}
+        for version in provider.list_function_versions():
+            versions.setdefault(version["code_sha256"], version["arn"])
+        for key, item in packages.items():
+            if key in kept:
+                continue
+            digest = provider.head_object(bucket, key).get("sha256")
+            if not digest:
+                digest = base64.b64encode(
+                    hashlib.sha256(provider.get_object(bucket, key)).digest()
+                ).decode()
+            if digest in versions:
+                kept[key] = f"used by {versions[digest]}"
+            else:
+                candidates[key] = item
+
+        # Reporting the garbage
+        report = {
+            "dry_run": dry_run,
+            "kept": dict(sorted(kept.items())),
+            "deleted": sorted(candidates),
+            "bytes": sum(item["size"] for item in candidates.values()),
+            "errors": [],
+        }
+        print(
+            f"{"Would delete" if dry_run else "Deleting"} {len(report["deleted"])} objects "
+            f"({report["bytes"]} bytes), keeping {len(report["kept"])}"
+        )
+        for key in report["deleted"]:
+            print(f"{"Would delete" if dry_run else "Deleting"} {key}")
+
+        # Deleting the garbage in batches of 1000 keys, the DeleteObjects limit
+        if not dry_run and report["deleted"]:
+            batches = [
+                report["deleted"][index : index + 1000]
+                for index in range(0, len(report["deleted"]), 1000)
+            ]
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for errors in executor.map(
+                    lambda batch: provider.delete_objects(bucket, batch), batches
+                ):
+                    report["errors"].extend(errors)
+            errors = set(report["errors"])
+            report["deleted"] = [key for key in report["deleted"] if key not in errors]
+
+        # Closing the provider
+        provider.close()
+
+        return report
+
+    def _clean_mjs(self, file_path):
+
+        # Read the file and apply the rules
+        with open(file_path, "r") as f:
+            file_clean = self._clean_rules(f)
+
+        # Write the cleaned file
+        with open(file_path, "w") as f:
+            f.write(file_clean)
+
+    def _clean_rules(self, lines):
+
+        # Initialize the file_clean string and the rules list
+        file_clean = ""
+        rules = []
+
+        # Apply the rules
+        for line in lines:
+            line_strip = line.strip()
+            if line_strip.startswith("//// IF"):
+                line_split = line_strip.split(" ")
+                rule = [line_split[2], "==", line_split[3]]
+                if rule in rules:
+                    raise ValueError("Rule is already in use")
+                rules.append(rule)
+            elif line_strip.startswith("//// ENDIF"):
+                if len(rules) == 0:
+                    raise ValueError("No rule to close")
+                rules.pop()
+            else:
+                write = True
+                for rule in rules:
+                    if rule[1] == "==" and self.config[rule[0]] == rule[2]:
+                        continue
+                    else:
+                        write = False
+                        break
+                if write:
+                    file_clean += line
+
+        return file_clean
+
+    def _replace_mjs(self, file_path):
+
+        # Read the file and apply the rules
+        with open(file_path, "r") as f:
+            file_content = f.read()
+
+        # Replace the variables
+        for key in self.config:
+            file_content = file_content.replace(f"<<<{key}>>>", str(self.config[key]))
+
+        # Write the cleaned file
+        with open(file_path, "w") as f:
+            f.write(file_content)
+
+    def _instrument_mjs(self, file_path, function_name):
+
+        # Read the file
+        with open(file_path, "r") as f:
+            file_content = f.read()
+
+        # Wrap the SDK client calls
+        file_instrumented = re.sub(
+            r"\b(\w+Client)\.send\(", r"probe.send(\1, ", file_content
+        )
+
+        # Wrap the exported handler
+        if "export async function handler(" in file_instrumented:
+            file_instrumented = file_instrumented.replace(
+                "export async function handler(", "async function handlerUninstrumented("
+            )
+            file_instrumented += f"\nexport const handler = probe.handler('{function_name}', handlerUninstrumented);\n"
+
+        # Import the probes only where something was wrapped
+        if file_instrumented != file_content:
+            file_instrumented = "import { probe } from './probe.mjs';\n" + file_instrumented
+
+        # Write the instrumented file
         with open(file_path, "w") as f:
-            f.write(file_content)
\ No newline at end of file
+            f.write(file_instrumented)
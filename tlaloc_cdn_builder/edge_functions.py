@@ -1,22 +1,96 @@
 edge_functions = {
     "viewer-request": {
+        "event_type": "viewer-request",
         "memory": 128,
         "timeout": 5,
         "runtime": "nodejs20.x",
     },
     "api-origin-request": {
+        "event_type": "origin-request",
         "memory": 128,
         "timeout": 5,
         "runtime": "nodejs20.x",
+        "syslog": True,
     },
     "s3-origin-request": {
+        "event_type": "origin-request",
         "memory": 128,
         "timeout": 5,
         "runtime": "nodejs20.x",
     },
     "api-origin-response": {
+        "event_type": "origin-response",
         "memory": 128,
         "timeout": 5,
         "runtime": "nodejs20.x",
+        "syslog": True,
     },
 }
+
+regional_functions = {
+    "syslog-processor": {
+        "memory": 128,
+        "timeout": 30,
+        "runtime": "nodejs20.x",
+        "source": "index.js",
+    },
+    "syslog-log-groups": {
+        "memory": 128,
+        "timeout": 30,
+        "runtime": "python3.12",
+        "source": "index.py",
+    },
+}
+
+event_types = {
+    "viewer-request": {
+        "memory_max": 128,
+        "timeout_max": 5,
+    },
+    "viewer-response": {
+        "memory_max": 128,
+        "timeout_max": 5,
+    },
+    "origin-request": {
+        "memory_max": 10240,
+        "timeout_max": 30,
+    },
+    "origin-response": {
+        "memory_max": 10240,
+        "timeout_max": 30,
+    },
+}
+
+syslog_sinks = ["sqs", "batch", "cloudwatch"]
+
+# Regions of the CloudFront regional edge caches, where Lambda@Edge runs and writes its logs
+edge_regions = [
+    "ap-northeast-1",
+    "ap-northeast-2",
+    "ap-south-1",
+    "ap-southeast-1",
+    "ap-southeast-2",
+    "eu-central-1",
+    "eu-west-1",
+    "eu-west-2",
+    "sa-east-1",
+    "us-east-1",
+    "us-east-2",
+    "us-west-1",
+    "us-west-2",
+]
+
+cors_methods = ["GET", "HEAD", "OPTIONS", "PUT", "PATCH", "POST", "DELETE", "ALL"]
+
+frame_options = ["DENY", "SAMEORIGIN"]
+
+referrer_policies = [
+    "no-referrer",
+    "no-referrer-when-downgrade",
+    "origin",
+    "origin-when-cross-origin",
+    "same-origin",
+    "strict-origin",
+    "strict-origin-when-cross-origin",
+    "unsafe-url",
+]
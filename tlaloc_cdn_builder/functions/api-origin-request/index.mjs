@@ -1,16 +1,14 @@
 
 import { DynamoDBClient, QueryCommand } from '@aws-sdk/client-dynamodb';
-import { SQSClient, SendMessageCommand } from '@aws-sdk/client-sqs';
+import { compilePermissions, conditionMatches, matchPermissions } from './permissions.mjs';
+import { TtlCache } from './cache.mjs';
 import { WeelockErrors } from './errors/WeelockErrors.mjs';
-import { minimatch } from 'minimatch';
+import { syslogWrite } from './syslog.mjs';
 import { unmarshall } from '@aws-sdk/util-dynamodb';
 
-const awsAccountId = 'maketemplate_aws_account_id';
-const makePrefix = 'maketemplate_make_prefix';
-const queueSyslogWrite = `https://sqs.sa-east-1.amazonaws.com/${awsAccountId}/${makePrefix}_user_syslogWrite.fifo`;
 const tableConfigPermissions = 'maketemplate_table_config_permissions';
-
-const sqsClient = new SQSClient({ region: 'sa-east-1' });
+const cacheSize = Number('<<<aws_cache_size>>>');
+const permissionsTtl = Number('<<<aws_permissions_ttl>>>') * 1000;
 
 // Default api version for when weelockAuthentication does not have the information
 const apiVersionDefault = {
@@ -22,6 +20,9 @@ const apiVersionDefault = {
 
 const dynamoClient = new DynamoDBClient({ region: 'sa-east-1' });
 
+// Compiled permission indexes cached between invocations by principal
+const permissionsCache = new TtlCache(cacheSize, permissionsTtl);
+
 export async function handler(event) {
     let request = null;
     try {
@@ -30,9 +31,9 @@ export async function handler(event) {
         // Getting weelock authentication header
         const weelockAuthentication = getWeelockAuthentication(request);
         // Getting permissions
-        const permissions = (await getPermissions(weelockAuthentication)).filter((permission) => permissionsFilter(permission, request, weelockAuthentication));
+        const permissions = matchPermissions(await getPermissionsIndex(weelockAuthentication), request, weelockAuthentication);
         // Checking permissions
-        if (permissions.filter((permission) => permission.effect === 'allow').length === 0) {
+        if (permissions.allow.length === 0) {
             if (weelockAuthentication.authorized) {
                 throw new WeelockErrors.Forbidden(request.method);
             } else {
@@ -40,8 +41,8 @@ export async function handler(event) {
             }
         }
         const conditionalParameters = getConditionalParameters(weelockAuthentication, request);
-        checkProhibitions(permissions, conditionalParameters);
-        checkAuthorizations(permissions, conditionalParameters);
+        checkProhibitions(permissions.deny, conditionalParameters);
+        checkAuthorizations(permissions.allow, conditionalParameters);
         // Resolve API endpoint
         resolveApiEndpoint(weelockAuthentication, request);
         // Return
@@ -49,32 +50,12 @@ export async function handler(event) {
     } catch (exception) {
         if (exception.response) {
             event.Records[0].cf.response = exception.response;
-            return await syslogWrite(event);
+            return await syslogWrite(event, 'api-origin-request');
         }
         throw exception;
     }
 }
 
-async function syslogWrite(event) {
-    const params = {
-        MessageBody: JSON.stringify({
-            item: event,
-            operation: 'api-origin-request',
-        }),
-        MessageDeduplicationId: String(Date.now()),
-        MessageGroupId: 'default',
-        QueueUrl: queueSyslogWrite,
-    };
-    try {
-        const command = new SendMessageCommand(params);
-        await sqsClient.send(command);
-    } catch (exception) {
-        // eslint-disable-next-line no-console
-        console.log(exception);
-    }
-    return event.Records[0].cf.response;
-}
-
 function resolveApiEndpoint(weelockAuthentication, request) {
     const apiVersionConfig = `api_${request.uri.split('/')[2]}_version`;
     let apiVersion = apiVersionDefault[apiVersionConfig];
@@ -88,30 +69,22 @@ function resolveApiEndpoint(weelockAuthentication, request) {
     return true;
 }
 
-function checkProhibitions(permissions, conditionalParameters) {
-    const permissionsDeny = permissions.filter((permission) => permission.effect === 'deny');
-    if (permissionsDeny.filter((permission) => !permission.condition).length > 0) {
+function checkProhibitions(permissionsDeny, conditionalParameters) {
+    if (permissionsDeny.some((permission) => !permission.condition)) {
         throw new WeelockErrors.Forbidden(conditionalParameters.request.method);
     }
     for (let iter = 0; iter < permissionsDeny.length; iter += 1) {
-        const permission = permissionsDeny[iter];
-        // eslint-disable-next-line no-new-func
-        const conditionValidation = new Function('parameters', permission.condition);
-        if (conditionValidation(conditionalParameters)) {
+        if (conditionMatches(permissionsDeny[iter], conditionalParameters)) {
             throw new WeelockErrors.Forbidden(conditionalParameters.request.method);
         }
     }
 }
-function checkAuthorizations(permissions, conditionalParameters) {
-    const permissionsAllow = permissions.filter((permission) => permission.effect === 'allow');
-    if (permissionsAllow.filter((permission) => !permission.condition).length > 0) {
+function checkAuthorizations(permissionsAllow, conditionalParameters) {
+    if (permissionsAllow.some((permission) => !permission.condition)) {
         return true;
     }
     for (let iter = 0; iter < permissionsAllow.length; iter += 1) {
-        const permission = permissionsAllow[iter];
-        // eslint-disable-next-line no-new-func
-        const conditionValidation = new Function('parameters', permission.condition);
-        if (conditionValidation(conditionalParameters)) {
+        if (conditionMatches(permissionsAllow[iter], conditionalParameters)) {
             return true;
         }
     }
@@ -125,24 +98,11 @@ function getConditionalParameters(weelockAuthentication, request) {
     };
 }
 
-function permissionsFilter(permission, request, weelockAuthentication) {
-    // Filter method
-    if (!permission.methods.has('*') && !permission.methods.has(request.method)) {
-        return false;
-    }
-    // Filter resource
-    if (!minimatch(request.uri, permission.resource)) {
-        return false;
-    }
-    // Filter method negation
-    if (permission.methods.has(`!${request.method}`)) {
-        return false;
-    }
-    // Check exception
-    if (!weelockAuthentication.authorized && !permission.authorized_exception) {
-        return false;
-    }
-    return true;
+// eslint-disable-next-line require-await
+async function getPermissionsIndex(weelockAuthentication) {
+    const claims = weelockAuthentication.claims || {};
+    const principal = JSON.stringify([claims.sub || null, [...(claims.groups || [])].sort()]);
+    return permissionsCache.fetch(principal, async () => compilePermissions(await getPermissions(weelockAuthentication)));
 }
 
 async function getPermissions(weelockAuthentication) {
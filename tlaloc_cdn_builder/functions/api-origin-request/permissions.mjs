@@ -0,0 +1,117 @@
+
+import { Minimatch } from 'minimatch';
+
+// Characters that make a resource segment a glob instead of a literal path segment
+const globMagic = /[*?[\]{}()!+@\\]/u;
+
+// Paths without repeated slashes nor . or .. segments, whose segments can be walked literally
+const canonicalUri = /^(?!.*\/\/)(?!(?:.*\/)?\.\.?(?:\/|$))/u;
+
+// Builds the permission index of a principal, rules are grouped by method and by the literal path prefix of their resource
+export function compilePermissions(permissions) {
+    const index = new Map();
+    permissions.forEach((permission) => {
+        const methods = [...permission.methods];
+        const rule = {
+            authorizedException: Boolean(permission.authorized_exception),
+            condition: permission.condition,
+            effect: permission.effect,
+            excludedMethods: new Set(methods.filter((method) => method.startsWith('!')).map((method) => method.slice(1))),
+            matcher: new Minimatch(permission.resource),
+        };
+        // A wildcard rule already applies to every method, indexing it once avoids evaluating it twice
+        const methodsIndexed = methods.includes('*') ? ['*'] : methods.filter((method) => !method.startsWith('!'));
+        methodsIndexed.forEach((method) => {
+            if (!index.has(method)) {
+                index.set(method, newNode());
+            }
+            let node = index.get(method);
+            literalPrefix(permission.resource).forEach((segment) => {
+                if (!node.children.has(segment)) {
+                    node.children.set(segment, newNode());
+                }
+                node = node.children.get(segment);
+            });
+            node.rules.push(rule);
+        });
+    });
+    return index;
+}
+
+// Returns the allow and deny rules of the index that apply to the request
+export function matchPermissions(index, request, weelockAuthentication) {
+    const matches = {
+        allow: [],
+        deny: [],
+    };
+    const collect = (node) => {
+        node.rules.forEach((rule) => {
+            if (matches[rule.effect] && ruleMatches(rule, request, weelockAuthentication)) {
+                matches[rule.effect].push(rule);
+            }
+        });
+    };
+    const roots = [index.get('*'), index.get(request.method)].filter(Boolean);
+    // minimatch collapses repeated slashes and dot segments, so such paths are checked against every rule of the method
+    if (!canonicalUri.test(request.uri)) {
+        roots.forEach((root) => walkAll(root, collect));
+        return matches;
+    }
+    const segments = request.uri.split('/');
+    roots.forEach((root) => {
+        let node = root;
+        for (let depth = 0; node; depth += 1) {
+            collect(node);
+            node = node.children.get(segments[depth]);
+        }
+    });
+    return matches;
+}
+
+// Evaluates the rule condition, compiled on first use and kept with the rule
+export function conditionMatches(rule, conditionalParameters) {
+    if (!rule.conditionValidation) {
+        // eslint-disable-next-line no-new-func
+        rule.conditionValidation = new Function('parameters', rule.condition);
+    }
+    return rule.conditionValidation(conditionalParameters);
+}
+
+function ruleMatches(rule, request, weelockAuthentication) {
+    // Filter method negation
+    if (rule.excludedMethods.has(request.method)) {
+        return false;
+    }
+    // Check exception
+    if (!weelockAuthentication.authorized && !rule.authorizedException) {
+        return false;
+    }
+    // Filter resource
+    return rule.matcher.match(request.uri);
+}
+
+// Repeated slashes are collapsed and dot segments end the prefix, as minimatch does not match them literally
+function literalPrefix(resource) {
+    const prefix = [];
+    for (const [iter, segment] of resource.split('/').entries()) {
+        if (globMagic.test(segment) || segment === '.' || segment === '..') {
+            break;
+        }
+        if (iter === 0 || segment !== '') {
+            prefix.push(segment);
+        }
+    }
+    return prefix;
+}
+
+function walkAll(node, callback) {
+    callback(node);
+    node.children.forEach((child) => walkAll(child, callback));
+}
+
+function newNode() {
+    return {
+        children: new Map(),
+        rules: [],
+    };
+}
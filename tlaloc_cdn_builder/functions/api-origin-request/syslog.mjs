@@ -0,0 +1,134 @@
+
+//// IF aws_syslog_sink sqs
+import { SQSClient, SendMessageCommand } from '@aws-sdk/client-sqs';
+//// ENDIF
+//// IF aws_syslog_sink batch
+import { SQSClient, SendMessageBatchCommand } from '@aws-sdk/client-sqs';
+//// ENDIF
+
+const awsAccountId = 'maketemplate_aws_account_id';
+const makePrefix = 'maketemplate_make_prefix';
+const queueSyslogWrite = `https://sqs.sa-east-1.amazonaws.com/${awsAccountId}/${makePrefix}_user_syslogWrite.fifo`;
+
+// SQS accepts up to 10 entries and 256 KiB per batch, messages are bounded so a full batch always fits
+const messageBytes = 25 * 1024;
+
+//// IF aws_syslog_sink sqs
+const sqsClient = new SQSClient({ region: 'sa-east-1' });
+//// ENDIF
+//// IF aws_syslog_sink batch
+const sqsClient = new SQSClient({ region: 'sa-east-1' });
+const batchEntries = 10;
+// Bounds the memory held while the queue is slow or unreachable, the oldest messages are dropped first
+const bufferEntries = 1000;
+const syslogBuffer = [];
+let syslogSending = false;
+//// ENDIF
+
+//// IF aws_syslog_sink sqs
+// Synchronous sink, the response waits for the message to be accepted by the queue
+export async function syslogWrite(event, operation) {
+    const params = {
+        MessageBody: JSON.stringify({
+            item: event,
+            operation,
+        }),
+        MessageDeduplicationId: String(Date.now()),
+        MessageGroupId: 'default',
+        QueueUrl: queueSyslogWrite,
+    };
+    try {
+        const command = new SendMessageCommand(params);
+        await sqsClient.send(command);
+    } catch (exception) {
+        // eslint-disable-next-line no-console
+        console.log(exception);
+    }
+    return event.Records[0].cf.response;
+}
+//// ENDIF
+//// IF aws_syslog_sink batch
+// Fire and forget sink, messages are buffered and sent in batches without holding the response
+// eslint-disable-next-line require-await
+export async function syslogWrite(event, operation) {
+    syslogBuffer.push({
+        MessageBody: syslogMessage(event, operation),
+        MessageDeduplicationId: `${Date.now()}-${Math.random().toString(36).slice(2)}`,
+        MessageGroupId: 'default',
+    });
+    if (syslogBuffer.length > bufferEntries) {
+        const dropped = syslogBuffer.splice(0, syslogBuffer.length - bufferEntries);
+        // eslint-disable-next-line no-console
+        console.log(`Syslog buffer full, ${dropped.length} oldest entries dropped`);
+    }
+    // Messages arriving while a batch is in flight are sent with the next one
+    if (!syslogSending) {
+        syslogFlush();
+    }
+    return event.Records[0].cf.response;
+}
+
+function syslogFlush() {
+    const entries = syslogBuffer.splice(0, batchEntries).map((entry, iter) => ({ ...entry, Id: String(iter) }));
+    syslogSending = true;
+    sqsClient.send(new SendMessageBatchCommand({ Entries: entries, QueueUrl: queueSyslogWrite }))
+        .then((data) => {
+            if (data.Failed && data.Failed.length > 0) {
+                // eslint-disable-next-line no-console
+                console.log('Syslog batch failed entries:', data.Failed);
+            }
+        })
+        .catch((exception) => {
+            // eslint-disable-next-line no-console
+            console.log(exception);
+        })
+        .finally(() => {
+            syslogSending = false;
+            if (syslogBuffer.length > 0) {
+                syslogFlush();
+            }
+        });
+}
+//// ENDIF
+//// IF aws_syslog_sink cloudwatch
+// Log sink, structured lines are shipped to the queue by the syslog-processor function
+// eslint-disable-next-line require-await
+export async function syslogWrite(event, operation) {
+    // eslint-disable-next-line no-console
+    console.log(`SYSLOG ${syslogMessage(event, operation)}`);
+    return event.Records[0].cf.response;
+}
+//// ENDIF
+
+// Serializes the event dropping the request body and then the whole event when it does not fit in a message
+function syslogMessage(event, operation) {
+    let message = JSON.stringify({
+        item: event,
+        operation,
+    });
+    if (Buffer.byteLength(message) <= messageBytes) {
+        return message;
+    }
+    const { request, response } = event.Records[0].cf;
+    const item = structuredClone(event);
+    if (item.Records[0].cf.request && item.Records[0].cf.request.body) {
+        item.Records[0].cf.request.body.data = '';
+        item.Records[0].cf.request.body.inputTruncated = true;
+    }
+    message = JSON.stringify({
+        item,
+        operation,
+    });
+    if (Buffer.byteLength(message) <= messageBytes) {
+        return message;
+    }
+    return JSON.stringify({
+        item: {
+            method: request && request.method,
+            status: response && response.status,
+            uri: request && request.uri,
+        },
+        operation,
+        truncated: true,
+    });
+}
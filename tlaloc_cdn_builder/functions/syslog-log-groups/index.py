@@ -0,0 +1,36 @@
+# Creates the log groups of the edge functions for their syslog subscription in this region
+#
+# Inlined by CloudFormation in the stack set of every edge region. Lambda@Edge creates the group itself
+# on the first invocation served by a region, so an existing group is kept and none is ever deleted.
+
+import boto3
+import cfnresponse
+from botocore.exceptions import ClientError
+
+
+def handler(event, context):
+    """
+    This function creates the log group of a custom resource unless it already exists
+
+    Parameters:
+        event (dict): The custom resource request, LogGroupName is the only property
+        context (object): The Lambda context
+
+    Returns:
+        None
+    """
+
+    log_group_name = event["ResourceProperties"]["LogGroupName"]
+    status = cfnresponse.SUCCESS
+    try:
+        if event["RequestType"] in ["Create", "Update"]:
+            boto3.client("logs").create_log_group(logGroupName=log_group_name)
+    except ClientError as exception:
+        if exception.response["Error"]["Code"] != "ResourceAlreadyExistsException":
+            print(exception)
+            status = cfnresponse.FAILED
+    except Exception as exception:
+        print(exception)
+        status = cfnresponse.FAILED
+
+    cfnresponse.send(event, context, status, {}, log_group_name)
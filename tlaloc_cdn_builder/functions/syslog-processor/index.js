@@ -0,0 +1,37 @@
+
+// Inlined by CloudFormation in the stack set of every edge region, so it is kept as a dependency free CommonJS module
+const { SQSClient, SendMessageBatchCommand } = require('@aws-sdk/client-sqs');
+const { gunzipSync } = require('zlib');
+
+const awsAccountId = 'maketemplate_aws_account_id';
+const makePrefix = 'maketemplate_make_prefix';
+const queueSyslogWrite = `https://sqs.sa-east-1.amazonaws.com/${awsAccountId}/${makePrefix}_user_syslogWrite.fifo`;
+
+const batchEntries = 10;
+const syslogMarker = 'SYSLOG ';
+
+const sqsClient = new SQSClient({ region: 'sa-east-1' });
+
+// Receives the CloudWatch Logs subscription of the edge functions and ships their syslog lines to the queue
+exports.handler = async function handler(event) {
+    const logs = JSON.parse(gunzipSync(Buffer.from(event.awslogs.data, 'base64')).toString());
+    const entries = logs.logEvents
+        .filter((logEvent) => logEvent.message.includes(syslogMarker))
+        .map((logEvent) => ({
+            MessageBody: logEvent.message.slice(logEvent.message.indexOf(syslogMarker) + syslogMarker.length).trim(),
+            MessageDeduplicationId: logEvent.id,
+            MessageGroupId: 'default',
+        }));
+    const batches = [];
+    for (let iter = 0; iter < entries.length; iter += batchEntries) {
+        const batch = entries.slice(iter, iter + batchEntries).map((entry, index) => ({ ...entry, Id: String(index) }));
+        batches.push(sqsClient.send(new SendMessageBatchCommand({ Entries: batch, QueueUrl: queueSyslogWrite })));
+    }
+    const results = await Promise.all(batches);
+    const failed = results.flatMap((result) => result.Failed || []);
+    if (failed.length > 0) {
+        // Failing the invocation makes CloudWatch Logs retry the delivery
+        throw new Error(`Syslog entries not delivered: ${JSON.stringify(failed)}`);
+    }
+    return { delivered: entries.length };
+};
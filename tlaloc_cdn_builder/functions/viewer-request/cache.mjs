@@ -0,0 +1,74 @@
+
+import { createHash } from 'crypto';
+
+// Bounded LRU cache with per entry TTL that survives between invocations of a warm container
+export class TtlCache {
+    constructor(capacity, ttl) {
+        this.capacity = capacity;
+        this.ttl = ttl;
+        this.entries = new Map();
+        this.pending = new Map();
+        this.stats = {
+            coalesced: 0,
+            hits: 0,
+            misses: 0,
+        };
+    }
+
+    get(key) {
+        const entry = this.entries.get(key);
+        if (!entry) {
+            return undefined;
+        }
+        this.entries.delete(key);
+        if (entry.expires <= Date.now()) {
+            return undefined;
+        }
+        // Reinserting moves the key to the most recently used position
+        this.entries.set(key, entry);
+        return entry.value;
+    }
+
+    set(key, value, ttl = this.ttl) {
+        if (!(this.capacity > 0 && ttl > 0)) {
+            return;
+        }
+        this.entries.delete(key);
+        while (this.entries.size >= this.capacity) {
+            this.entries.delete(this.entries.keys().next().value);
+        }
+        this.entries.set(key, {
+            expires: Date.now() + ttl,
+            value,
+        });
+    }
+
+    // Resolves key from the cache or the loader, sharing a single loader call between concurrent lookups
+    fetch(key, loader, ttl = this.ttl) {
+        const value = this.get(key);
+        if (value !== undefined) {
+            this.stats.hits += 1;
+            return Promise.resolve(value);
+        }
+        if (this.pending.has(key)) {
+            this.stats.coalesced += 1;
+            return this.pending.get(key);
+        }
+        this.stats.misses += 1;
+        const promise = Promise.resolve()
+            .then(loader)
+            .then((loaded) => {
+                this.set(key, loaded, ttl);
+                return loaded;
+            })
+            .finally(() => {
+                this.pending.delete(key);
+            });
+        this.pending.set(key, promise);
+        return promise;
+    }
+}
+
+export function digest(value) {
+    return createHash('sha256').update(value).digest('hex');
+}
@@ -4,12 +4,16 @@ import { DynamoDBClient, GetItemCommand } from '@aws-sdk/client-dynamodb';
 import { marshall, unmarshall } from '@aws-sdk/util-dynamodb';
 import { CognitoJwtVerifier } from 'aws-jwt-verify';
 import { JwtExpiredError } from 'aws-jwt-verify/error';
+import { TtlCache, digest } from './cache.mjs';
 import { WeelockErrors } from './errors/WeelockErrors.mjs';
 import { parse } from 'path';
 
 const tableConfigAccess = 'maketemplate_table_config_access';
 const userPoolClientId = 'maketemplate_user_pool_client_id';
 const userPoolId = 'maketemplate_user_pool_id';
+const cacheSize = Number('<<<aws_cache_size>>>');
+const cacheTtl = Number('<<<aws_cache_ttl>>>') * 1000;
+const configTtl = Number('<<<aws_config_ttl>>>') * 1000;
 
 const cognitoClient = new CognitoIdentityProviderClient({ region: 'sa-east-1' });
 const dynamodbClient = new DynamoDBClient({ region: 'sa-east-1' });
@@ -20,6 +24,11 @@ const verifier = CognitoJwtVerifier.create({
     userPoolId,
 });
 
+// Lookups cached between invocations, user attributes by access token digest and config by sub
+// A revoked access token is accepted until its cached attributes expire, cacheTtl at most
+const userAttributesCache = new TtlCache(cacheSize, cacheTtl);
+const userConfigCache = new TtlCache(cacheSize, configTtl);
+
 export async function handler(event) {
     let request = null;
     try {
@@ -88,9 +97,9 @@ function isUriExempted(uri) {
 
 // eslint-disable-next-line require-await
 async function cognitoVerifyAccessToken(accessToken, uri, querystring) {
-    const command = new GetUserCommand({ AccessToken: accessToken });
-    return cognitoClient.send(command)
-        .then((data) => data.UserAttributes)
+    const loader = () => cognitoClient.send(new GetUserCommand({ AccessToken: accessToken }))
+        .then((data) => data.UserAttributes);
+    return userAttributesCache.fetch(digest(accessToken), loader, accessTokenTtl(accessToken))
         .catch((error) => {
             if (error.name !== 'NotAuthorizedException') {
                 // eslint-disable-next-line no-console
@@ -116,7 +125,7 @@ async function userGetConfig(claimSub) {
         }),
         TableName: tableConfigAccess,
     };
-    return dynamodbClient.send(new GetItemCommand(params))
+    const loader = () => dynamodbClient.send(new GetItemCommand(params))
         .then((data) => {
             if (data.Item) {
                 const item = unmarshall(data.Item);
@@ -126,7 +135,8 @@ async function userGetConfig(claimSub) {
             return {
                 valid: true,
             };
-        })
+        });
+    return userConfigCache.fetch(claimSub, loader)
         .catch((error) => {
             // eslint-disable-next-line no-console
             console.log(error);
@@ -136,6 +146,19 @@ async function userGetConfig(claimSub) {
         });
 }
 
+// Cached user attributes must not outlive the access token they were obtained with
+function accessTokenTtl(accessToken) {
+    try {
+        const payload = JSON.parse(Buffer.from(accessToken.split('.')[1], 'base64url').toString());
+        if (!Number.isFinite(payload.exp)) {
+            return 0;
+        }
+        return Math.min(cacheTtl, (payload.exp * 1000) - Date.now());
+    } catch (error) {
+        return 0;
+    }
+}
+
 // eslint-disable-next-line require-await
 async function jwtVerifyAccessToken(accessToken) {
     try {
@@ -0,0 +1,396 @@
+import os
+import json
+import math
+import time
+import base64
+import shutil
+import zipfile
+import tempfile
+import subprocess
+
+from importlib.resources import files
+from .edge_functions import edge_functions, event_types
+from .stats import percentiles
+
+# Packages replaced by the tools/sdk.mjs stand-in when running a function
+sdk_packages = [
+    "@aws-sdk/client-cognito-identity-provider",
+    "@aws-sdk/client-dynamodb",
+    "@aws-sdk/client-sqs",
+    "@aws-sdk/util-dynamodb",
+    "aws-jwt-verify",
+]
+
+# Responses of the stubbed SDK commands, DynamoDB items are given in their marshalled form
+default_responses = {
+    "GetUserCommand": {
+        "UserAttributes": [
+            {"Name": "sub", "Value": "00000000-0000-0000-0000-000000000000"},
+            {"Name": "email", "Value": "name@domain.tld"},
+        ]
+    },
+    "GetItemCommand": {
+        "Item": {
+            "sub": {"S": "00000000-0000-0000-0000-000000000000"},
+            "api_user_version": {"S": "S000001"},
+        }
+    },
+    "QueryCommand": {
+        "Items": [
+            {
+                "effect": {"S": "allow"},
+                "methods": {"SS": ["*"]},
+                "resource": {"S": "/api/**"},
+                "sub": {"S": "*"},
+            }
+        ]
+    },
+    "SendMessageCommand": {},
+    "SendMessageBatchCommand": {"Failed": []},
+}
+
+
+def synthetic_corpus(principals=50):
+    """
+    This function creates a corpus of synthetic CloudFront events for each event type
+
+    Each principal has its own sub, group and access token, so the lookups cached by the
+    functions miss once per principal and the latencies include the SDK calls
+
+    Parameters:
+        principals (int): The number of users the authenticated requests are spread over
+
+    Returns:
+        dict: A list of events for each event type
+    """
+
+    def encode(value):
+        return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+    def credentials(index):
+        sub = f"00000000-0000-0000-0000-{index:012d}"
+        group = f"user{index % 10:03d}"
+        access_token = "{}.{}.signature".format(
+            encode({"alg": "RS256", "kid": "synthetic"}),
+            encode(
+                {
+                    "cognito:groups": [group],
+                    "exp": int(time.time()) + 3600,
+                    "sub": sub,
+                    "token_use": "access",
+                }
+            ),
+        )
+        weelock_authentication = json.dumps(
+            {
+                "accessTokenSource": "COOKIE",
+                "authorized": True,
+                "claims": {"groups": [group], "sub": sub},
+                "config": {"valid": True},
+            }
+        )
+        return access_token, weelock_authentication
+
+    users = [credentials(index) for index in range(principals)]
+
+    def event(event_type, method, uri, headers, response=None):
+        record = {
+            "config": {
+                "distributionDomainName": "d111111abcdef8.cloudfront.net",
+                "distributionId": "EDFDVBD6EXAMPLE",
+                "eventType": event_type,
+                "requestId": "synthetic",
+            },
+            "request": {
+                "clientIp": "203.0.113.178",
+                "headers": {
+                    key.lower(): [{"key": key, "value": value}]
+                    for key, value in headers.items()
+                },
+                "method": method,
+                "querystring": "",
+                "uri": uri,
+            },
+        }
+        if response:
+            record["response"] = {
+                "headers": {},
+                "status": response[0],
+                "statusDescription": response[1],
+            }
+        return {"Records": [{"cf": record}]}
+
+    requests = [
+        ("GET", "/api/user/items"),
+        ("POST", "/api/user/items"),
+        ("GET", "/api/profile/me"),
+        ("GET", "/index.html"),
+        ("GET", "/assets/app.js"),
+    ]
+
+    return {
+        "viewer-request": [
+            event(
+                "viewer-request",
+                method,
+                uri,
+                {"Host": "cdn.example.com", "Cookie": f"access-token={access_token}"},
+            )
+            for access_token, _ in users
+            for method, uri in requests
+        ]
+        + [event("viewer-request", "GET", "/index.html", {"Host": "cdn.example.com"})],
+        "origin-request": [
+            event(
+                "origin-request",
+                method,
+                uri,
+                {
+                    "Host": "cdn.example.com",
+                    "Weelock-Authentication": weelock_authentication,
+                },
+            )
+            for _, weelock_authentication in users
+            for method, uri in requests
+        ],
+        "origin-response": [
+            event(
+                "origin-response",
+                method,
+                uri,
+                {"Host": "cdn.example.com"},
+                response,
+            )
+            for method, uri in requests[:3]
+            for response in [("200", "OK"), ("500", "Internal Server Error")]
+        ],
+    }
+
+
+def stub_packages(path, packages):
+    """
+    This function replaces node packages of a function folder by the tools/sdk.mjs stand-in
+
+    Parameters:
+        path (str): The function folder
+        packages (iterable): The names of the packages to replace
+
+    Returns:
+        None
+    """
+
+    sdk_url = f"file://{files("tlaloc_cdn_builder.tools").joinpath("sdk.mjs")}"
+    for package in packages:
+        path_package = os.path.join(path, "node_modules", package)
+        shutil.rmtree(path_package, ignore_errors=True)
+        os.makedirs(path_package)
+        json.dump(
+            {
+                "name": package,
+                "type": "module",
+                "exports": {".": "./index.mjs", "./error": "./index.mjs"},
+            },
+            open(os.path.join(path_package, "package.json"), "w"),
+        )
+        with open(os.path.join(path_package, "index.mjs"), "w") as f:
+            f.write(f"export * from '{sdk_url}';\n")
+
+
+def recommend_memory(peak_rss_mb, event_type, headroom=1.5):
+    """
+    This function recommends the memory of a function from its measured peak memory
+
+    Parameters:
+        peak_rss_mb (float): The peak resident memory measured in MB
+        event_type (str): The event type the function is associated with
+        headroom (float): The factor applied to the measured peak
+
+    Returns:
+        int: The memory in MB, rounded up to 64 MB and within the limits of the event type
+    """
+
+    memory = math.ceil(peak_rss_mb * headroom / 64) * 64
+
+    return min(max(memory, 128), event_types[event_type]["memory_max"])
+
+
+class harness:
+    """
+    This class runs the packaged edge functions in a local Node process to size them
+
+    Parameters:
+        builder (builder): A builder that has already built the CDN
+        corpus (dict): A list of CloudFront events for each event type (default synthetic_corpus())
+        latency (dict): Milliseconds each stubbed SDK command takes by command name, "default" applies to the rest (default 50)
+        responses (dict): Response of each stubbed SDK command by command name (default default_responses)
+        invocations (int): Number of warm invocations measured for each function (default 200)
+        max_errors (int): Number of invocations of each function that may throw before the run fails (default 0)
+
+    Raises:
+        ValueError: If the CDN has not been built
+    """
+
+    def __init__(
+        self,
+        builder,
+        corpus=None,
+        latency=None,
+        responses=None,
+        invocations=200,
+        max_errors=0,
+    ):
+
+        if not builder.built:
+            raise ValueError("You must build the CDN before running the harness")
+
+        self.builder = builder
+        self.corpus = corpus if corpus is not None else synthetic_corpus()
+        self.latency = latency if latency is not None else {"default": 50}
+        self.responses = responses if responses is not None else default_responses
+        self.invocations = invocations
+        self.max_errors = max_errors
+        self.results = {}
+
+    def run(self):
+        """
+        This function runs every packaged edge function against the corpus of its event type
+
+        Parameters:
+            None
+
+        Returns:
+            dict: The measurements of each function
+
+        Raises:
+            ValueError: If a function fails to run
+            ValueError: If the invocations of a function throw more than max_errors times
+        """
+
+        for name, function in edge_functions.items():
+
+            if not function.get("zip"):
+                continue
+
+            events = self.corpus.get(function["event_type"])
+            if not events:
+                print(f"{name} - No events for {function["event_type"]}, skipping")
+                continue
+
+            print(f"{name} - Running {self.invocations} invocations")
+            measurement = self._run_function(function, events)
+            peak_rss_mb = measurement["peak_rss_bytes"] / 1024 / 1024
+            self.results[name] = {
+                "event_type": function["event_type"],
+                "cold_start_ms": measurement["cold_start_ms"],
+                "errors": measurement["errors"],
+                "error_messages": measurement["error_messages"],
+                "latency_ms": percentiles(measurement["latencies_ms"]),
+                "peak_rss_mb": peak_rss_mb,
+                "sdk_calls": measurement["sdk_calls"],
+                "memory": function["memory"],
+                "memory_recommended": recommend_memory(
+                    peak_rss_mb, function["event_type"]
+                ),
+            }
+
+        # Reporting the measurements
+        print(
+            "Harness results:\n    {}".format(
+                json.dumps(self.results, indent=4).replace("\n", "\n    ")
+            )
+        )
+
+        # Failing the run when the handlers threw, their timings do not measure the function
+        failed = [
+            name
+            for name, result in self.results.items()
+            if result["errors"] > self.max_errors
+        ]
+        if failed:
+            raise ValueError(
+                "Harness invocations failed: {}".format(
+                    ", ".join(f"{name} ({self.results[name]["errors"]})" for name in failed)
+                )
+            )
+
+        return self.results
+
+    def recommend(self):
+        """
+        This function returns the recommended memory of the measured functions
+
+        Parameters:
+            None
+
+        Returns:
+            dict: The memory of each function, ready to be used as the aws_functions_memory builder parameter or passed to build to check the configured memory
+
+        Raises:
+            ValueError: If the harness has not been run
+        """
+
+        if not self.results:
+            raise ValueError("You must run the harness before getting recommendations")
+
+        return {
+            name: result["memory_recommended"] for name, result in self.results.items()
+        }
+
+    def _run_function(self, function, events):
+        """
+        This function extracts a function package and runs it with the stubbed SDK
+
+        Parameters:
+            function (dict): The function definition
+            events (list): The events to invoke the function with
+
+        Returns:
+            dict: The raw measurements reported by the runner
+
+        Raises:
+            ValueError: If the runner fails
+        """
+
+        tools = files("tlaloc_cdn_builder.tools")
+        path_temporal = tempfile.mkdtemp(prefix=f"harness-{function["name"]}-")
+
+        try:
+
+            # Extracting the package
+            with zipfile.ZipFile(f".CDN/{function["zip"]}") as package:
+                package.extractall(path_temporal)
+
+            # Replacing the SDK packages by the stand-in
+            stub_packages(path_temporal, sdk_packages)
+
+            # Running the function
+            json.dump(events, open(os.path.join(path_temporal, "events.json"), "w"))
+            process = subprocess.run(
+                [
+                    "node",
+                    str(tools.joinpath("harness.mjs")),
+                    path_temporal,
+                    os.path.join(path_temporal, "events.json"),
+                    str(self.invocations),
+                    os.path.join(path_temporal, "result.json"),
+                ],
+                env={
+                    **os.environ,
+                    "HARNESS_CONFIG": json.dumps(
+                        {"latency": self.latency, "responses": self.responses}
+                    ),
+                },
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+            if process.returncode != 0:
+                raise ValueError(
+                    f"Error running {function["name"]} function:\n{process.stderr}"
+                )
+
+            return json.load(open(os.path.join(path_temporal, "result.json")))
+
+        finally:
+
+            shutil.rmtree(path_temporal, ignore_errors=True)
@@ -0,0 +1,68 @@
+import gzip
+import json
+
+from .stats import percentiles
+
+
+def parse_emf(lines):
+    """
+    This function extracts the timings written by the instrumented edge functions from log lines
+
+    Parameters:
+        lines (iterable): Log lines, optionally prefixed by a timestamp or any other text before the JSON payload
+
+    Returns:
+        generator: Tuples of function name, step name and milliseconds
+    """
+
+    for line in lines:
+
+        # Locating the JSON payload of the line
+        start = line.find("{")
+        if start < 0:
+            continue
+        try:
+            payload = json.loads(line[start:])
+        except ValueError:
+            continue
+        if not isinstance(payload, dict) or "_aws" not in payload:
+            continue
+
+        # Reading the declared metrics, each one can hold one or several values
+        for directive in payload["_aws"].get("CloudWatchMetrics", []):
+            for metric in directive.get("Metrics", []):
+                values = payload.get(metric["Name"])
+                if values is None:
+                    continue
+                if not isinstance(values, list):
+                    values = [values]
+                for value in values:
+                    yield payload.get("Function", "unknown"), metric["Name"], value
+
+
+def aggregate(paths, points=(50, 90, 99)):
+    """
+    This function calculates the latency percentiles of each function and step from exported log files
+
+    Parameters:
+        paths (list): Paths of the exported log files, gzip compressed files must end with .gz
+        points (tuple): The percentiles to calculate
+
+    Returns:
+        dict: For each function and step, the number of samples and its percentiles in milliseconds
+    """
+
+    samples = {}
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt") as f:
+            for function, step, value in parse_emf(f):
+                samples.setdefault(function, {}).setdefault(step, []).append(value)
+
+    return {
+        function: {
+            step: {"count": len(values), **percentiles(values, points)}
+            for step, values in sorted(steps.items())
+        }
+        for function, steps in sorted(samples.items())
+    }
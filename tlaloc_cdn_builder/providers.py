@@ -0,0 +1,582 @@
+import os
+import json
+import time
+import boto3
+import base64
+import shutil
+import hashlib
+
+from botocore.exceptions import ClientError
+from tlaloc_commons import commons  # type: ignore
+
+
+class aws_provider:
+    """
+    This class stores artifacts in S3 and deploys the stacks with CloudFormation
+
+    Parameters:
+        config (dict): The builder config, aws_profile is used to open the session
+    """
+
+    def __init__(self, config):
+
+        self.config = config
+        self.aws = boto3.Session(profile_name=config["aws_profile"])
+        self.s3_client = self.aws.client("s3")
+
+    def close(self):
+        """
+        This function closes the clients of the provider
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        """
+
+        self.s3_client.close()
+
+    def upload_file(self, path, bucket, key, metadata=None):
+        """
+        This function uploads a file to a bucket
+
+        Parameters:
+            path (str): The path of the file to upload
+            bucket (str): The name of the bucket
+            key (str): The key of the object
+            metadata (dict): The metadata stored with the object
+
+        Returns:
+            None
+        """
+
+        self.s3_client.upload_file(
+            path, bucket, key, ExtraArgs={"Metadata": metadata or {}}
+        )
+
+    def list_objects(self, bucket, prefix):
+        """
+        This function lists the objects of a bucket under a prefix
+
+        Parameters:
+            bucket (str): The name of the bucket
+            prefix (str): The prefix of the keys
+
+        Returns:
+            list: The key, size and last_modified timestamp of each object
+        """
+
+        objects = []
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for item in page.get("Contents", []):
+                objects.append(
+                    {
+                        "key": item["Key"],
+                        "size": item["Size"],
+                        "last_modified": item["LastModified"].timestamp(),
+                    }
+                )
+
+        return objects
+
+    def get_object(self, bucket, key):
+        """
+        This function reads an object of a bucket
+
+        Parameters:
+            bucket (str): The name of the bucket
+            key (str): The key of the object
+
+        Returns:
+            bytes: The content of the object
+        """
+
+        return self.s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
+
+    def head_object(self, bucket, key):
+        """
+        This function reads the metadata of an object of a bucket
+
+        Parameters:
+            bucket (str): The name of the bucket
+            key (str): The key of the object
+
+        Returns:
+            dict: The metadata stored with the object
+        """
+
+        return self.s3_client.head_object(Bucket=bucket, Key=key)["Metadata"]
+
+    def delete_objects(self, bucket, keys):
+        """
+        This function deletes up to 1000 objects of a bucket with a single request
+
+        Parameters:
+            bucket (str): The name of the bucket
+            keys (list): The keys of the objects
+
+        Returns:
+            list: The keys that could not be deleted
+        """
+
+        response = self.s3_client.delete_objects(
+            Bucket=bucket,
+            Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+        )
+
+        return [error["Key"] for error in response.get("Errors", [])]
+
+    def list_function_versions(self):
+        """
+        This function lists the code of every version of the functions of the stack, retained ones included
+
+        Parameters:
+            None
+
+        Returns:
+            list: The ARN and base64 encoded SHA-256 digest of the code of each version
+
+        Raises:
+            ClientError: If the stack resources or the versions cannot be listed, a missing stack has no versions
+        """
+
+        # Listing the functions of the stack
+        cloudformation_client = self.aws.client("cloudformation")
+        function_names = []
+        try:
+            paginator = cloudformation_client.get_paginator("list_stack_resources")
+            for page in paginator.paginate(StackName=self.config["aws_stack"]):
+                for resource in page["StackResourceSummaries"]:
+                    if resource["ResourceType"] == "AWS::Lambda::Function":
+                        function_names.append(resource["PhysicalResourceId"])
+        except ClientError as exception:
+            # Only a stack that does not exist yet has no versions, any other failure would hide versions in use
+            error = exception.response.get("Error", {})
+            if error.get("Code") != "ValidationError" or "does not exist" not in error.get("Message", ""):
+                raise
+            function_names = []
+        finally:
+            cloudformation_client.close()
+
+        # Listing the versions of each function, including $LATEST
+        lambda_client = self.aws.client("lambda", region_name=self.config["aws_region"])
+        versions = []
+        for function_name in function_names:
+            paginator = lambda_client.get_paginator("list_versions_by_function")
+            for page in paginator.paginate(FunctionName=function_name):
+                for version in page["Versions"]:
+                    versions.append(
+                        {
+                            "arn": version["FunctionArn"],
+                            "code_sha256": version["CodeSha256"],
+                        }
+                    )
+        lambda_client.close()
+
+        return versions
+
+    def deploy(self, builder, wait=False):
+        """
+        This function deploys the template uploaded by the builder
+
+        Parameters:
+            builder (builder): The builder whose template is deployed
+            wait (bool): Whether to wait for the deployment to finish
+
+        Returns:
+            str: The status of the stack after the deployment
+        """
+
+        # The commons helpers read the session from the builder
+        builder.aws = self.aws
+        commons.aws.cloudformation.deploy(builder, capabilities=["CAPABILITY_IAM"])
+
+        # Wait for the deployment to finish
+        if wait:
+            print("Waiting for the deployment to finish")
+            commons.aws.cloudformation.deploy_wait(builder)
+        del builder.aws
+
+        return self.stack_status()
+
+    def stack_status(self):
+        """
+        This function returns the status of the stack
+
+        Parameters:
+            None
+
+        Returns:
+            str: The CloudFormation status of the stack
+        """
+
+        cloudformation_client = self.aws.client("cloudformation")
+        stack = cloudformation_client.describe_stacks(
+            StackName=self.config["aws_stack"]
+        )["Stacks"][0]
+        cloudformation_client.close()
+
+        return stack["StackStatus"]
+
+
+class local_provider:
+    """
+    This class stores artifacts and stack deployments in a local folder, so the whole pipeline runs without an AWS account
+
+    Objects are kept in <local_path>/buckets/<bucket>/<key> with their metadata in
+    <local_path>/metadata/<bucket>/<key>.json, and each stack in <local_path>/stacks/<stack>.json
+
+    Parameters:
+        config (dict): The builder config, local_path is the folder used as storage
+    """
+
+    def __init__(self, config):
+
+        self.config = config
+        self.path = config["local_path"]
+        os.makedirs(self.path, exist_ok=True)
+
+    def close(self):
+        """
+        This function closes the provider
+
+        Parameters:
+            None
+
+        Returns:
+            None
+        """
+
+        return None
+
+    def upload_file(self, path, bucket, key, metadata=None):
+        """
+        This function copies a file into a bucket folder
+
+        Parameters:
+            path (str): The path of the file to upload
+            bucket (str): The name of the bucket
+            key (str): The key of the object
+            metadata (dict): The metadata stored with the object
+
+        Returns:
+            None
+        """
+
+        path_object = self._path_object(bucket, key)
+        os.makedirs(os.path.dirname(path_object), exist_ok=True)
+        shutil.copyfile(path, path_object)
+
+        path_metadata = self._path_metadata(bucket, key)
+        os.makedirs(os.path.dirname(path_metadata), exist_ok=True)
+        json.dump(metadata or {}, open(path_metadata, "w"))
+
+    def list_objects(self, bucket, prefix):
+        """
+        This function lists the objects of a bucket folder under a prefix
+
+        Parameters:
+            bucket (str): The name of the bucket
+            prefix (str): The prefix of the keys
+
+        Returns:
+            list: The key, size and last_modified timestamp of each object
+        """
+
+        path_bucket = os.path.join(self.path, "buckets", bucket)
+        objects = []
+        for path, _, path_files in os.walk(path_bucket):
+            for file in path_files:
+                path_object = os.path.join(path, file)
+                key = os.path.relpath(path_object, path_bucket).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    objects.append(
+                        {
+                            "key": key,
+                            "size": os.path.getsize(path_object),
+                            "last_modified": os.path.getmtime(path_object),
+                        }
+                    )
+
+        return sorted(objects, key=lambda item: item["key"])
+
+    def get_object(self, bucket, key):
+        """
+        This function reads an object of a bucket folder
+
+        Parameters:
+            bucket (str): The name of the bucket
+            key (str): The key of the object
+
+        Returns:
+            bytes: The content of the object
+
+        Raises:
+            ValueError: If the object does not exist
+        """
+
+        path_object = self._path_object(bucket, key)
+        if not os.path.isfile(path_object):
+            raise ValueError(f"Object {key} does not exist in bucket {bucket}")
+
+        with open(path_object, "rb") as f:
+            return f.read()
+
+    def head_object(self, bucket, key):
+        """
+        This function reads the metadata of an object of a bucket folder
+
+        Parameters:
+            bucket (str): The name of the bucket
+            key (str): The key of the object
+
+        Returns:
+            dict: The metadata stored with the object
+
+        Raises:
+            ValueError: If the object does not exist
+        """
+
+        if not os.path.isfile(self._path_object(bucket, key)):
+            raise ValueError(f"Object {key} does not exist in bucket {bucket}")
+
+        path_metadata = self._path_metadata(bucket, key)
+        if not os.path.isfile(path_metadata):
+            return {}
+
+        return json.load(open(path_metadata))
+
+    def delete_objects(self, bucket, keys):
+        """
+        This function deletes objects of a bucket folder, missing objects count as deleted like in S3
+
+        Parameters:
+            bucket (str): The name of the bucket
+            keys (list): The keys of the objects
+
+        Returns:
+            list: The keys that could not be deleted
+        """
+
+        errors = []
+        for key in keys:
+            for path in [self._path_object(bucket, key), self._path_metadata(bucket, key)]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    errors.append(key)
+
+        return sorted(set(errors))
+
+    def list_function_versions(self):
+        """
+        This function lists the code of every version of the functions of the simulated stack, retained ones included
+
+        Parameters:
+            None
+
+        Returns:
+            list: The ARN and base64 encoded SHA-256 digest of the code of each version
+        """
+
+        stack = self._stack_load()
+        if not stack:
+            return []
+
+        return [
+            {"arn": resource["physical_id"], "code_sha256": resource.get("code_sha256")}
+            for resource in stack["resources"].values()
+            if resource["type"] in ["AWS::Lambda::Function", "AWS::Lambda::Version"]
+        ]
+
+    def deploy(self, builder, wait=False):
+        """
+        This function simulates the CloudFormation deployment of the template uploaded by the builder
+
+        The stack goes through the same statuses as in CloudFormation, rolling back when a function
+        artifact is missing from its bucket. Resources removed from the template are kept when their
+        DeletionPolicy is Retain.
+
+        Parameters:
+            builder (builder): The builder whose template is deployed
+            wait (bool): Ignored, the simulated deployment always finishes before returning
+
+        Returns:
+            str: The status of the stack after the deployment
+
+        Raises:
+            ValueError: If the stack is being updated, must be deleted after a failed creation or
+                the deployment rolls back
+        """
+
+        template = json.loads(
+            self.get_object(
+                self.config["aws_bucket"],
+                f"{self.config["aws_folder"]}/{self.config["aws_template_file"]}",
+            )
+        )
+        stack = self._stack_load()
+
+        if stack and stack["status"].endswith("_IN_PROGRESS"):
+            raise ValueError(f"Stack {self.config["aws_stack"]} is in {stack["status"]}")
+
+        # A stack whose creation rolled back can only be deleted, as in CloudFormation
+        if stack and stack["status"] == "ROLLBACK_COMPLETE":
+            raise ValueError(
+                f"Stack:arn:aws:cloudformation:{self.config["aws_region"]}:{self.config["aws_account_id"]}"
+                f":stack/{stack["name"]} is in ROLLBACK_COMPLETE state and can not be updated."
+            )
+
+        # Initializing the stack
+        operation = "UPDATE" if stack else "CREATE"
+        if not stack:
+            stack = {"name": self.config["aws_stack"], "resources": {}, "events": []}
+            self._stack_event(stack, "REVIEW_IN_PROGRESS")
+        self._stack_event(stack, f"{operation}_IN_PROGRESS")
+
+        # Checking the function artifacts like CloudFormation does when creating them
+        missing = [
+            resource["Properties"]["Code"]["S3Key"]
+            for resource in template["Resources"].values()
+            if resource["Type"] == "AWS::Lambda::Function"
+            and not os.path.isfile(
+                self._path_object(
+                    resource["Properties"]["Code"]["S3Bucket"],
+                    resource["Properties"]["Code"]["S3Key"],
+                )
+            )
+        ]
+        if missing:
+            if operation == "CREATE":
+                self._stack_event(stack, "ROLLBACK_IN_PROGRESS", f"Missing {missing}")
+                self._stack_event(stack, "ROLLBACK_COMPLETE")
+            else:
+                self._stack_event(stack, "UPDATE_ROLLBACK_IN_PROGRESS", f"Missing {missing}")
+                self._stack_event(stack, "UPDATE_ROLLBACK_COMPLETE")
+            self._stack_save(stack)
+            raise ValueError(f"Deployment of {stack["name"]} rolled back, missing {missing}")
+
+        # Creating and updating resources
+        resources = {}
+        for logical_id, resource in template["Resources"].items():
+            resources[logical_id] = stack["resources"].get(logical_id) or {
+                "type": resource["Type"],
+                "physical_id": self._physical_id(stack, logical_id, resource, template),
+                "retained": False,
+            }
+            resources[logical_id]["properties"] = resource.get("Properties", {})
+            resources[logical_id]["deletion_policy"] = resource.get("DeletionPolicy")
+            resources[logical_id]["retained"] = False
+            if resource["Type"] == "AWS::Lambda::Function":
+                resources[logical_id]["code_sha256"] = self._code_sha256(
+                    resource["Properties"]["Code"]
+                )
+
+        # Publishing the new versions with the code of their function
+        for resource in resources.values():
+            if resource["type"] == "AWS::Lambda::Version" and "code_sha256" not in resource:
+                function_id = resource["properties"]["FunctionName"]["Ref"]
+                resource["code_sha256"] = resources[function_id]["code_sha256"]
+
+        # Deleting the resources no longer in the template unless they are retained
+        if operation == "UPDATE":
+            self._stack_event(stack, "UPDATE_COMPLETE_CLEANUP_IN_PROGRESS")
+        for logical_id, resource in stack["resources"].items():
+            if logical_id not in resources and (
+                resource["retained"] or resource.get("deletion_policy") == "Retain"
+            ):
+                resource["retained"] = True
+                resources[logical_id] = resource
+
+        stack["resources"] = resources
+        stack["template"] = self.config["aws_template_file"]
+        self._stack_event(stack, f"{operation}_COMPLETE")
+        self._stack_save(stack)
+
+        return stack["status"]
+
+    def stack_status(self):
+        """
+        This function returns the status of the simulated stack
+
+        Parameters:
+            None
+
+        Returns:
+            str: The status of the stack, None if it has never been deployed
+        """
+
+        stack = self._stack_load()
+
+        return stack["status"] if stack else None
+
+    def _physical_id(self, stack, logical_id, resource, template):
+
+        # Functions and versions get ARNs as they are referenced by the distribution
+        region = self.config["aws_region"]
+        account = self.config["aws_account_id"]
+        if resource["Type"] == "AWS::Lambda::Function":
+            return f"arn:aws:lambda:{region}:{account}:function:{resource["Properties"]["FunctionName"]}"
+        if resource["Type"] == "AWS::Lambda::Version":
+            function_id = resource["Properties"]["FunctionName"]["Ref"]
+            function_name = template["Resources"][function_id]["Properties"]["FunctionName"]
+            version = 1 + sum(
+                1
+                for item in stack["resources"].values()
+                if item["type"] == "AWS::Lambda::Version"
+                and item["properties"]["FunctionName"]["Ref"] == function_id
+            )
+            return f"arn:aws:lambda:{region}:{account}:function:{function_name}:{version}"
+
+        return f"{stack["name"]}-{logical_id}-{int(time.time())}"
+
+    def _code_sha256(self, code):
+
+        # Lambda reports the base64 encoded SHA-256 digest of the package as CodeSha256
+        metadata = self.head_object(code["S3Bucket"], code["S3Key"])
+        if metadata.get("sha256"):
+            return metadata["sha256"]
+        digest = hashlib.sha256(self.get_object(code["S3Bucket"], code["S3Key"])).digest()
+
+        return base64.b64encode(digest).decode()
+
+    def _stack_event(self, stack, status, reason=None):
+
+        stack["status"] = status
+        stack["events"].append({"timestamp": time.time(), "status": status, "reason": reason})
+
+    def _stack_load(self):
+
+        path_stack = os.path.join(self.path, "stacks", f"{self.config["aws_stack"]}.json")
+        if not os.path.isfile(path_stack):
+            return None
+
+        return json.load(open(path_stack))
+
+    def _stack_save(self, stack):
+
+        os.makedirs(os.path.join(self.path, "stacks"), exist_ok=True)
+        json.dump(
+            stack,
+            indent=4,
+            sort_keys=True,
+            fp=open(os.path.join(self.path, "stacks", f"{stack["name"]}.json"), "w"),
+        )
+
+    def _path_object(self, bucket, key):
+
+        return os.path.join(self.path, "buckets", bucket, *key.split("/"))
+
+    def _path_metadata(self, bucket, key):
+
+        return os.path.join(self.path, "metadata", bucket, *key.split("/")) + ".json"
+
+
+providers = {
+    "aws": aws_provider,
+    "local": local_provider,
+}
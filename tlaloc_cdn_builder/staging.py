@@ -0,0 +1,115 @@
+import math
+
+from .stats import percentiles
+
+# Edge result types served from the CloudFront cache
+hit_result_types = ["Hit", "RefreshHit"]
+
+# Limits of the staging thresholds, latency ratios compare staging with primary
+default_thresholds = {
+    "requests": 100,
+    "hit_ratio": 0.02,
+    "latency": {"p50": 1.1, "p90": 1.2, "p99": 1.5},
+}
+
+
+def parse_access_logs(lines):
+    """
+    This function extracts the latency and cache result of each request from CloudFront standard access logs
+
+    Parameters:
+        lines (iterable): Log lines, the #Fields directive names the columns of the following lines
+
+    Returns:
+        generator: Tuples of milliseconds taken and edge result type
+    """
+
+    fields = []
+    for line in lines:
+        line = line.rstrip("\n")
+
+        # Reading the column names
+        if line.startswith("#Fields:"):
+            fields = line[len("#Fields:") :].split()
+            continue
+        if not line or line.startswith("#") or not fields:
+            continue
+
+        # Reading the request
+        values = dict(zip(fields, line.split("\t")))
+        try:
+            milliseconds = float(values["time-taken"]) * 1000
+        except (KeyError, ValueError):
+            continue
+        yield milliseconds, values.get("x-edge-result-type", "-")
+
+
+def summarize(requests, points=(50, 90, 99)):
+    """
+    This function calculates the request count, hit ratio and latency percentiles of a distribution
+
+    Parameters:
+        requests (iterable): Tuples of milliseconds taken and edge result type
+        points (tuple): The percentiles to calculate
+
+    Returns:
+        dict: The number of requests, the ratio served from cache and the latency percentiles in milliseconds
+    """
+
+    latencies = []
+    hits = 0
+    for milliseconds, result_type in requests:
+        latencies.append(milliseconds)
+        if result_type in hit_result_types:
+            hits += 1
+
+    return {
+        "requests": len(latencies),
+        "hit_ratio": hits / len(latencies) if latencies else None,
+        **percentiles(latencies, points),
+    }
+
+
+def evaluate(primary, staging, thresholds):
+    """
+    This function compares the summaries of the primary and staging distributions against the thresholds
+
+    Parameters:
+        primary (dict): The summary of the primary distribution
+        staging (dict): The summary of the staging distribution
+        thresholds (dict): The minimum requests of each distribution, the maximum hit ratio drop and the maximum latency ratio of each percentile
+
+    Returns:
+        dict: Both summaries, the differences, the result of each check and whether all of them passed
+    """
+
+    differences = {}
+    checks = {
+        "requests": min(primary["requests"], staging["requests"]) >= thresholds["requests"]
+    }
+
+    # Comparing the hit ratios, staging may lose up to the threshold
+    if primary["hit_ratio"] is not None and staging["hit_ratio"] is not None:
+        differences["hit_ratio"] = staging["hit_ratio"] - primary["hit_ratio"]
+        checks["hit_ratio"] = differences["hit_ratio"] >= -thresholds["hit_ratio"]
+    else:
+        checks["hit_ratio"] = False
+
+    # Comparing the latency percentiles as ratios
+    for point, ratio in thresholds["latency"].items():
+        if primary.get(point) is not None and staging.get(point) is not None:
+            if primary[point]:
+                differences[point] = staging[point] / primary[point]
+            else:
+                differences[point] = math.inf if staging[point] else 1.0
+            checks[point] = differences[point] <= ratio
+        else:
+            checks[point] = False
+
+    return {
+        "primary": primary,
+        "staging": staging,
+        "differences": differences,
+        "checks": checks,
+        "passed": all(checks.values()),
+    }
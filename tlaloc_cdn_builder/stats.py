@@ -0,0 +1,25 @@
+import math
+
+
+def percentiles(values, points=(50, 90, 99)):
+    """
+    This function calculates nearest rank percentiles
+
+    Parameters:
+        values (list): The measured values
+        points (tuple): The percentiles to calculate
+
+    Returns:
+        dict: The value of each percentile keyed as p<point>, None when there are no values
+    """
+
+    ordered = sorted(values)
+    result = {}
+    for point in points:
+        if not ordered:
+            result[f"p{point}"] = None
+            continue
+        rank = max(1, math.ceil(point / 100 * len(ordered)))
+        result[f"p{point}"] = ordered[rank - 1]
+
+    return result
@@ -0,0 +1,60 @@
+
+// Runs a packaged edge function against a corpus of CloudFront events and reports its timings and memory
+//
+// Usage: node harness.mjs <functionFolder> <eventsFile> <invocations> <resultFile>
+
+import { readFileSync, writeFileSync } from 'fs';
+import { calls } from './sdk.mjs';
+import { join } from 'path';
+import { pathToFileURL } from 'url';
+
+const [functionFolder, eventsFile, invocations, resultFile] = process.argv.slice(2);
+const events = JSON.parse(readFileSync(eventsFile));
+
+// Distinct error messages kept for the report
+const errorMessages = 5;
+const errors = {
+    count: 0,
+    messages: [],
+};
+
+function elapsed(start) {
+    return Number(process.hrtime.bigint() - start) / 1e6;
+}
+
+async function invoke(handler, event) {
+    const start = process.hrtime.bigint();
+    try {
+        await handler(structuredClone(event));
+    } catch (exception) {
+        // Unhandled exceptions turn into 5xx errors at the edge, they are timed and reported as failures
+        errors.count += 1;
+        const message = String((exception && exception.stack) || exception);
+        if (errors.messages.length < errorMessages && !errors.messages.includes(message)) {
+            errors.messages.push(message);
+        }
+    }
+    return elapsed(start);
+}
+
+const start = process.hrtime.bigint();
+const { handler } = await import(pathToFileURL(join(functionFolder, 'index.mjs')));
+const importMs = elapsed(start);
+const firstMs = await invoke(handler, events[0]);
+
+let peakRss = process.memoryUsage().rss;
+const latencies = [];
+for (let iter = 0; iter < Number(invocations); iter += 1) {
+    latencies.push(await invoke(handler, events[iter % events.length]));
+    peakRss = Math.max(peakRss, process.memoryUsage().rss);
+}
+
+writeFileSync(resultFile, JSON.stringify({
+    cold_start_ms: importMs + firstMs,
+    error_messages: errors.messages,
+    errors: errors.count,
+    import_ms: importMs,
+    latencies_ms: latencies,
+    peak_rss_bytes: Math.max(peakRss, process.resourceUsage().maxRSS * 1024),
+    sdk_calls: calls,
+}));
@@ -0,0 +1,60 @@
+
+// Timing probes injected by the builder when aws_instrument is enabled
+//
+// Each invocation writes one CloudWatch Embedded Metric Format line with the milliseconds taken by
+// the handler and by every SDK command it sent
+
+const namespace = 'TlalocCdn';
+
+let timings = {};
+
+function record(step, start) {
+    const milliseconds = Number(process.hrtime.bigint() - start) / 1e6;
+    if (!timings[step]) {
+        timings[step] = [];
+    }
+    timings[step].push(Math.round(milliseconds * 1000) / 1000);
+}
+
+function emit(functionName) {
+    const steps = Object.keys(timings);
+    const line = {
+        _aws: {
+            CloudWatchMetrics: [{
+                Dimensions: [['Function']],
+                Metrics: steps.map((step) => ({ Name: step, Unit: 'Milliseconds' })),
+                Namespace: namespace,
+            }],
+            Timestamp: Date.now(),
+        },
+        Function: functionName,
+    };
+    steps.forEach((step) => {
+        line[step] = timings[step];
+    });
+    timings = {};
+    // Written without the console prefix so CloudWatch extracts the metrics
+    process.stdout.write(`${JSON.stringify(line)}\n`);
+}
+
+export const probe = {
+    handler(functionName, handler) {
+        return async (event) => {
+            const start = process.hrtime.bigint();
+            try {
+                return await handler(event);
+            } finally {
+                record('handler', start);
+                emit(functionName);
+            }
+        };
+    },
+
+    // Commands settling after the handler returned are reported with the next invocation
+    send(client, command) {
+        const start = process.hrtime.bigint();
+        return client.send(command).finally(() => {
+            record(command.constructor.name || 'send', start);
+        });
+    },
+};
@@ -0,0 +1,128 @@
+
+// Stand-in for the AWS SDK clients and aws-jwt-verify used by the edge functions when run by the harness
+//
+// Every command answers after the latency configured for its name with the configured response,
+// both read from the HARNESS_CONFIG environment variable
+
+const config = JSON.parse(process.env.HARNESS_CONFIG || '{}');
+const latency = config.latency || {};
+const responses = config.responses || {};
+
+export const calls = {};
+
+function sleep(milliseconds) {
+    return new Promise((resolve) => {
+        setTimeout(resolve, milliseconds);
+    });
+}
+
+class Client {
+    constructor(configuration) {
+        this.configuration = configuration;
+    }
+
+    async send(command) {
+        calls[command.commandName] = (calls[command.commandName] || 0) + 1;
+        await sleep(latency[command.commandName] ?? latency.default ?? 0);
+        const response = responses[command.commandName];
+        if (response && response.error) {
+            const error = new Error(response.error);
+            error.name = response.error;
+            throw error;
+        }
+        return structuredClone(response || {});
+    }
+}
+
+// Commands are named after the SDK class they replace, as the probes report them by class name
+function command(commandName) {
+    return {
+        [commandName]: class {
+            constructor(input) {
+                this.commandName = commandName;
+                this.input = input;
+            }
+        },
+    }[commandName];
+}
+
+export const CognitoIdentityProviderClient = Client;
+export const DynamoDBClient = Client;
+export const SQSClient = Client;
+
+export const GetItemCommand = command('GetItemCommand');
+export const GetUserCommand = command('GetUserCommand');
+export const QueryCommand = command('QueryCommand');
+export const SendMessageBatchCommand = command('SendMessageBatchCommand');
+export const SendMessageCommand = command('SendMessageCommand');
+
+export function marshall(item) {
+    return Object.fromEntries(Object.entries(item).map(([key, value]) => [key, marshallValue(value)]));
+}
+
+export function unmarshall(item) {
+    return Object.fromEntries(Object.entries(item).map(([key, value]) => [key, unmarshallValue(value)]));
+}
+
+function marshallValue(value) {
+    if (value === null || value === undefined) {
+        return { NULL: true };
+    } else if (typeof value === 'string') {
+        return { S: value };
+    } else if (typeof value === 'number') {
+        return { N: String(value) };
+    } else if (typeof value === 'boolean') {
+        return { BOOL: value };
+    } else if (value instanceof Set) {
+        return { SS: [...value] };
+    } else if (Array.isArray(value)) {
+        return { L: value.map(marshallValue) };
+    }
+    return { M: marshall(value) };
+}
+
+function unmarshallValue(value) {
+    const [[type, content]] = Object.entries(value);
+    switch (type) {
+    case 'S':
+        return content;
+    case 'N':
+        return Number(content);
+    case 'BOOL':
+        return content;
+    case 'NULL':
+        return null;
+    case 'SS':
+        return new Set(content);
+    case 'NS':
+        return new Set(content.map(Number));
+    case 'L':
+        return content.map(unmarshallValue);
+    default:
+        return unmarshall(content);
+    }
+}
+
+export class JwtExpiredError extends Error {
+    constructor(rawJwt) {
+        super('Token expired');
+        this.name = 'JwtExpiredError';
+        this.rawJwt = rawJwt;
+    }
+}
+
+// Tokens are decoded without checking their signature
+export const CognitoJwtVerifier = {
+    create() {
+        return {
+            // eslint-disable-next-line require-await
+            async verify(token) {
+                const payload = JSON.parse(Buffer.from(token.split('.')[1], 'base64url').toString());
+                if (payload.exp && payload.exp * 1000 < Date.now()) {
+                    throw new JwtExpiredError({ payload });
+                }
+                return payload;
+            },
+        };
+    },
+};